@@ -1,12 +1,18 @@
 # This file is part of Coog. The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import os
 import sys
 import time
+import pstats
+import tempfile
+import threading
+import tracemalloc
 from collections import defaultdict
 from io import StringIO
 
 import types
 import inspect
+import itertools
 import re
 import logging
 
@@ -14,11 +20,18 @@ from trytond.pool import Pool
 
 from . import debug
 from . import ir
+from .capture import capture_call
+from .tools import (StartupCosts, CacheStats, SearchStats, Tracer, Metrics,
+    LineProfiler, profile_to_folded, flame_graph_svg)
 
 logger = logging.getLogger('trytond:debug_module')
 
 
 def register():
+    from trytond.config import config
+    if config.getboolean('debug', 'startup_costs', default=False):
+        StartupCosts.patch()
+
     Pool.register(
         debug.FieldInfo,
         debug.ModelInfo,
@@ -31,6 +44,7 @@ def register():
         debug.DebugViewInstance,
         debug.DebugOnChangeRelation,
         debug.DebugOnChangeWithRelation,
+        debug.DebugIndexInstance,
         ir.User,
         module='debug', type_='model')
 
@@ -47,12 +61,67 @@ def register():
             set_method_names_for_profiling,
             name_one2many_gets,
             activate_auto_profile,
+            profile_overrides,
+            activate_memory_profile,
+            activate_line_profile,
             enable_debug_views,
+            report_startup_costs,
+            instrument_caches,
+            activate_tracing,
+            collect_metrics,
+            record_searches,
             module='debug')
     except AttributeError:
         logger.warning('Post init hooks disabled')
 
 
+def is_class_or_dual_method(method):
+    from trytond.pool import PoolMeta
+    return hasattr(method, '_dualmethod') or (
+        isinstance(method, types.MethodType) and
+        isinstance(method.__self__, PoolMeta))
+
+
+def get_config_list(key, default_key=None):
+    '''
+        Returns the comma separated values of the key of the debug section,
+        or of default_key if key is not set
+    '''
+    from trytond.config import config
+    value = config.get('debug', key, default=None)
+    if value is None and default_key:
+        value = config.get('debug', default_key, default=None)
+    return [x.strip() for x in (value or '').split(',') if x.strip()]
+
+
+def wrap_model_method(klass, method_name, wrapper):
+    '''
+        Replaces the method of klass by wrapper(method), where method is the
+        current method bound to klass (for class and dual methods) or the
+        function (for instance methods)
+    '''
+    from trytond.model import dualmethod
+    method = getattr(klass, method_name)
+    wrapped = wrapper(method)
+    # Keep the replaced method (None if it is inherited) for the override
+    # introspection
+    replaced = klass.__dict__.get(method_name)
+    is_dualmethod = hasattr(method, '_dualmethod') or isinstance(
+        inspect.getattr_static(klass, method_name), dualmethod)
+    if not is_dualmethod and not is_class_or_dual_method(method):
+        wrapped._debug_replaced = replaced
+        setattr(klass, method_name, wrapped)
+        return
+
+    def class_wrapped(cls, *args, **kwargs):
+        return wrapped(*args, **kwargs)
+    class_wrapped._debug_replaced = replaced
+    if is_dualmethod:
+        setattr(klass, method_name, dualmethod(class_wrapped))
+    else:
+        setattr(klass, method_name, classmethod(class_wrapped))
+
+
 def set_method_names_for_profiling(pool, update):
     '''
         Patches the pool initialization to separate given methods per model
@@ -159,7 +228,7 @@ def activate_auto_profile(pool, update):
 
     from configparser import NoSectionError
     from trytond.config import config
-    from trytond.pool import PoolMeta
+    from trytond.transaction import Transaction
 
     logger = logging.getLogger('trytond.autoprofile')
     try:
@@ -169,45 +238,104 @@ def activate_auto_profile(pool, update):
         entries = config.getint('debug', 'auto_profile_entries') or 80
         filename = config.get('debug', 'auto_profile_filename') or None
         dirs = config.getboolean('debug', 'auto_profile_show_dirs') or False
+        flame_graph_dir = config.get('debug', 'auto_profile_flame_graphs')
+        if flame_graph_dir:
+            os.makedirs(flame_graph_dir, exist_ok=True)
+        capture_dir = config.get('debug', 'auto_profile_captures')
+        if capture_dir:
+            os.makedirs(capture_dir, exist_ok=True)
+        aggregated = defaultdict(lambda: defaultdict(float))
+        aggregated_lock = threading.Lock()
+        counter = itertools.count()
 
-        def is_class_or_dual_method(method):
-            return hasattr(method, '_dualmethod') or (
-                isinstance(method, types.MethodType) and
-                isinstance(method.__self__, PoolMeta))
+        def file_signature(path):
+            # None if the file does not exist or is empty
+            if not path or not os.path.exists(path):
+                return None
+            stat = os.stat(path)
+            return (stat.st_size, stat.st_mtime_ns) if stat.st_size else None
 
-        def auto_profile(f):
-            def wrapped(self, *args, **kwargs):
+        def write_flame_graph(name, stats_file, duration):
+            folded = profile_to_folded(pstats.Stats(stats_file))
+            with aggregated_lock:
+                for stack, value in folded.items():
+                    aggregated[name][stack] += value
+                if duration < threshold:
+                    return
+                method_aggregated = dict(aggregated[name])
+            # One graph per slow call, and the aggregated graph of all the
+            # calls of the method in the current process
+            graphs = [('%s-%s-%s' % (name, time.strftime('%Y%m%d-%H%M%S'),
+                        next(counter)),
+                    folded, '%s (%.3fs)' % (name, duration)),
+                ('%s-aggregated' % name, method_aggregated,
+                    '%s (aggregated)' % name)]
+            for graph_name, data, title in graphs:
+                path = os.path.join(flame_graph_dir, '%s-%s.svg' % (
+                        re.sub(r'[^A-Za-z0-9]+', '_', graph_name),
+                        os.getpid()))
+                with open(path, 'w') as f:
+                    f.write(flame_graph_svg(data, title))
+                logger.info('Flame graph written in %s' % path)
+
+        def run_profiled(f, name, args, kwargs):
+            if Transaction().context.get('_debug_replay'):
+                return f(*args, **kwargs)
+            stats_file = filename
+            if flame_graph_dir and not stats_file:
+                fd, stats_file = tempfile.mkstemp(suffix='.prof')
+                os.close(fd)
+            try:
+                stats_before = file_signature(stats_file)
                 old_stdout = sys.stdout
                 my_stdout = sys.stdout = StringIO()
                 start = time.time()
-                res = profile(f, immediate=True, sort=list(order.split(',')),
-                    entries=entries, filename=filename, dirs=dirs)(
-                    self, *args, **kwargs)
-                end = time.time()
-                sys.stdout = old_stdout
+                try:
+                    res = profile(f, immediate=True,
+                        sort=list(order.split(',')), entries=entries,
+                        filename=stats_file, dirs=dirs)(*args, **kwargs)
+                finally:
+                    end = time.time()
+                    sys.stdout = old_stdout
                 if end - start >= threshold:
                     for line in my_stdout.getvalue().split('\n'):
                         logger.info(line)
+                    if capture_dir:
+                        try:
+                            model, method = name.split(':')
+                            path = capture_call(capture_dir, model, method,
+                                args, kwargs, end - start)
+                            logger.info('Call captured in %s' % path)
+                        except Exception:
+                            logger.exception('Could not capture the call of '
+                                '%s' % name)
+                if flame_graph_dir:
+                    try:
+                        # profilehooks does not dump the stats of nested
+                        # calls or of calls concurrent to another profiled
+                        # call
+                        signature = file_signature(stats_file)
+                        if signature and signature != stats_before:
+                            write_flame_graph(name, stats_file, end - start)
+                    except Exception:
+                        logger.exception('Could not write the flame graph of '
+                            '%s' % name)
                 return res
+            finally:
+                if stats_file != filename:
+                    os.remove(stats_file)
+
+        def auto_profile(f, name):
+            def wrapped(self, *args, **kwargs):
+                return run_profiled(f, name, (self,) + args, kwargs)
             if hasattr(f, '__origin_function'):
                 wrapped.__origin_function = f.__origin_function
             return wrapped
 
-        def auto_profile_cls(f):
+        def auto_profile_cls(f, name):
             @classmethod
             def wrapped(cls, *args, **kwargs):
-                old_stdout = sys.stdout
-                my_stdout = sys.stdout = StringIO()
-                start = time.time()
-                res = profile(f, immediate=True, sort=list(order.split(',')),
-                    entries=entries, filename=filename, dirs=dirs)(
-                    *args, **kwargs)
-                end = time.time()
-                sys.stdout = old_stdout
-                if end - start >= threshold:
-                    for line in my_stdout.getvalue().split('\n'):
-                        logger.info(line)
-                return res
+                return run_profiled(f, name, args, kwargs)
             if hasattr(f, '__origin_function'):
                 wrapped.__origin_function = f.__origin_function
             return wrapped
@@ -223,16 +351,441 @@ def activate_auto_profile(pool, update):
                 logger.warning('Enabling auto-profile for %s -> %s' % (
                         model, method))
                 method_obj = getattr(Model, method)
+                name = '%s:%s' % (model, method)
                 if is_class_or_dual_method(method_obj):
-                    setattr(Model, method, auto_profile_cls(method_obj))
+                    setattr(Model, method, auto_profile_cls(method_obj, name))
                 else:
-                    setattr(Model, method, auto_profile(method_obj))
+                    setattr(Model, method, auto_profile(method_obj, name))
     except ImportError:
         logger.warning('profilehooks not found, auto-profiling disabled')
     except NoSectionError:
         pass
 
 
+def profile_overrides(pool, update):
+    '''
+        Profiles the configured methods, and reports the time spent in each
+        module's override of the method, for calls longer than the threshold.
+        The aggregated report is available through the "raw_override_costs"
+        RPC call of "ir.model.debug.model_info" :
+
+            [debug]
+            override_profile_threshold=0.2
+
+            [override_profile]
+            line = account.move.line:create,write
+    '''
+    if update:
+        return
+
+    from configparser import NoSectionError
+    from trytond.config import config
+
+    logger = logging.getLogger('trytond.autoprofile')
+    try:
+        to_profile = config.items('override_profile')
+    except NoSectionError:
+        return
+    threshold = config.getfloat('debug', 'override_profile_threshold') or 0
+    ModelInfo = pool.get('ir.model.debug.model_info')
+
+    def profile_override(Model, method_name):
+        def profiled(method):
+            def wrapped(*args, **kwargs):
+                profiler = ModelInfo.get_override_profiler(Model,
+                    method_name)
+                start = time.time()
+                try:
+                    return profiler.runcall(method, *args, **kwargs)
+                finally:
+                    duration = time.time() - start
+                    frames = ModelInfo.add_override_profile(Model,
+                        method_name, profiler, duration)
+                    if duration >= threshold:
+                        logger.info('Override costs for %s:%s (%.3fs)' % (
+                                Model.__name__, method_name, duration))
+                        for line in ModelInfo.format_override_costs(frames):
+                            logger.info('    ' + line)
+            return wrapped
+        wrap_model_method(Model, method_name, profiled)
+
+    for _, data in to_profile:
+        model, methods = data.split(':')
+        Model = pool.get(model.strip())
+        for method_name in methods.split(','):
+            method_name = method_name.strip()
+            logger.warning('Enabling override profiling for %s -> %s' % (
+                    Model.__name__, method_name))
+            profile_override(Model, method_name)
+
+
+def report_startup_costs(pool, update):
+    '''
+        Logs the pool initialization costs per module and per model. They are
+        also available through the "raw_startup_costs" RPC call of
+        "ir.model.debug.model_info" :
+
+            [debug]
+            startup_costs=True
+            startup_costs_entries=20
+    '''
+    from trytond.config import config
+    if not config.getboolean('debug', 'startup_costs', default=False):
+        return
+    entries = config.getint('debug', 'startup_costs_entries', default=20)
+    logger.info('Pool initialization costs for %s%s' % (pool.database_name,
+            ' (update)' if update else ''))
+    for line in StartupCosts.format_report(entries):
+        logger.info('    ' + line)
+
+
+def instrument_caches(pool, update):
+    '''
+        Counts the hits, misses, evictions and invalidations of the in-process
+        caches. The counters are logged every "cache_stats_interval" seconds
+        (if set), and are available through the "raw_cache_stats" RPC call of
+        "ir.model.debug.model_info" :
+
+            [debug]
+            cache_stats=True
+            cache_stats_interval=300
+    '''
+    if update:
+        return
+
+    from trytond.config import config
+    if not config.getboolean('debug', 'cache_stats', default=False):
+        return
+    logger.warning('Enabling cache statistics')
+    CacheStats.patch(
+        config.getint('debug', 'cache_stats_interval', default=0))
+
+
+def record_searches(pool, update):
+    '''
+        Records the search calls of the configured models (all by default),
+        grouped by normalized domain and order. The searches are available
+        through the "raw_search_stats" RPC call of "ir.model.debug.model_info"
+        and are explained by its "advise_indexes" call, which suggests the
+        missing indexes of the fields filtered at least
+        "search_stats_min_count" times (also displayed on the fields of the
+        "debug.model" records) :
+
+            [debug]
+            search_stats=True
+            search_stats_models=party.party,contract
+            search_stats_min_count=10
+            search_stats_max_entries=1000
+
+        Only the "search_stats_max_entries" most recently used groups of
+        searches are kept.
+    '''
+    if update:
+        return
+
+    from trytond.config import config
+    from trytond.model import ModelSQL
+    if not config.getboolean('debug', 'search_stats', default=False):
+        return
+    models = get_config_list('search_stats_models')
+    SearchStats.max_entries = config.getint('debug',
+        'search_stats_max_entries', default=SearchStats.max_entries)
+
+    def recorded(method, model_name):
+        def wrapped(domain, *args, **kwargs):
+            if kwargs.get('query', args[4] if len(args) > 4 else False):
+                return method(domain, *args, **kwargs)
+            order = kwargs.get('order', args[2] if len(args) > 2 else None)
+            start = time.time()
+            try:
+                return method(domain, *args, **kwargs)
+            finally:
+                SearchStats.record(model_name, domain, order,
+                    time.time() - start)
+        return wrapped
+
+    logger.warning('Enabling search statistics for %s' % (
+            ', '.join(models) or 'all models'))
+    for klass in pool._pool[pool.database_name].get('model', {}).values():
+        if not issubclass(klass, ModelSQL):
+            continue
+        if models and klass.__name__ not in models:
+            continue
+        wrap_model_method(klass, 'search',
+            lambda method, name=klass.__name__: recorded(method, name))
+
+
+def activate_tracing(pool, update):
+    '''
+        Records a tree of spans for each RPC call (or outermost traced method
+        call) : model methods, field getters and SQL queries. The traces
+        longer than the threshold are written as trace-event JSON files in the
+        configured directory :
+
+            [debug]
+            tracing_directory=/tmp/traces
+            tracing_threshold=1
+            tracing_methods=read,search,create,write,delete
+            tracing_fields_methods=get
+            tracing_sql=True
+            tracing_max_events=100000
+
+        The methods default to the ones of the "methods" and "fields_methods"
+        keys.
+    '''
+    if update:
+        return
+
+    from trytond.config import config
+    directory = config.get('debug', 'tracing_directory')
+    if not directory:
+        return
+
+    Tracer.directory = directory
+    Tracer.threshold = config.getfloat('debug', 'tracing_threshold',
+        default=1)
+    Tracer.sql = config.getboolean('debug', 'tracing_sql', default=True)
+    Tracer.max_events = config.getint('debug', 'tracing_max_events',
+        default=Tracer.max_events)
+    methods = get_config_list('tracing_methods', 'methods')
+    fields_methods = get_config_list('tracing_fields_methods',
+        'fields_methods')
+    os.makedirs(directory, exist_ok=True)
+    logger.warning('Enabling tracing in %s' % directory)
+
+    try:
+        Tracer.patch_dispatch()
+    except ImportError:
+        pass
+
+    for klass in pool._pool[pool.database_name].get('model', {}).values():
+        for method_name in methods:
+            if hasattr(klass, method_name):
+                wrap_model_method(klass, method_name,
+                    lambda method, name=method_name: Tracer.wrap(method,
+                        '%s.%s' % (klass.__name__, name), 'method'))
+        for fname, field in list(klass._fields.items()):
+            for method_name in fields_methods:
+                if not hasattr(field, method_name):
+                    continue
+                object.__setattr__(field, method_name, Tracer.wrap(
+                        getattr(field, method_name),
+                        '%s.%s:%s' % (klass.__name__, fname, method_name),
+                        'field'))
+
+
+def collect_metrics(pool, update):
+    '''
+        Counts the calls and measures the latency of the configured methods
+        for all models. The metrics are available in Prometheus text format
+        through the "raw_metrics" RPC call of "ir.model.debug.model_info", or
+        on http://<metrics_host>:<metrics_port>/metrics if metrics_port is
+        set :
+
+            [debug]
+            metrics=True
+            metrics_methods=read,search,create,write,delete
+            metrics_buckets=0.01,0.1,1,10
+            metrics_host=127.0.0.1
+            metrics_port=9090
+
+        The methods default to the ones of the "methods" key.
+    '''
+    if update:
+        return
+
+    from trytond.config import config
+    if not config.getboolean('debug', 'metrics', default=False):
+        return
+    buckets = get_config_list('metrics_buckets')
+    if buckets:
+        Metrics.buckets = tuple(sorted(float(x) for x in buckets))
+    methods = get_config_list('metrics_methods', 'methods')
+    logger.warning('Enabling metrics for %s' % ', '.join(methods))
+    for klass in pool._pool[pool.database_name].get('model', {}).values():
+        for method_name in methods:
+            if hasattr(klass, method_name):
+                wrap_model_method(klass, method_name,
+                    lambda method, name=method_name: Metrics.wrap(method,
+                        klass.__name__, name))
+
+    port = config.getint('debug', 'metrics_port', default=0)
+    if port:
+        host = config.get('debug', 'metrics_host', default='127.0.0.1')
+        try:
+            Metrics.serve(host, port)
+        except OSError:
+            # Only the first process of a multi-process server can bind
+            logger.warning('Could not serve metrics on %s:%s' % (host, port),
+                exc_info=True)
+
+
+def activate_memory_profile(pool, update):
+    '''
+        Traces the memory allocations of the configured methods, and logs the
+        peak memory, the net allocated memory and the lines allocating the
+        most for the calls whose peak or net allocation (in MB) is above the
+        threshold :
+
+            [debug]
+            memory_profile_threshold=50
+            memory_profile_entries=10
+
+            [memory_profile]
+            payment = account.payment:process
+    '''
+    if update:
+        return
+
+    from configparser import NoSectionError
+    from trytond.config import config
+
+    logger = logging.getLogger('trytond.memoryprofile')
+    try:
+        to_profile = config.items('memory_profile')
+    except NoSectionError:
+        return
+    threshold = (config.getfloat('debug', 'memory_profile_threshold') or 0
+        ) * 1024 * 1024
+    entries = config.getint('debug', 'memory_profile_entries') or 10
+
+    # The profiled calls may be nested or run concurrently in several
+    # threads, so tracing is started by the first one and stopped by the last
+    # one. Peaks are only reset when a single profiled call is running, so
+    # they may include the allocations of the concurrent calls.
+    lock = threading.Lock()
+    state = {'users': 0, 'owned': False}
+
+    def acquire():
+        with lock:
+            state['users'] += 1
+            if state['users'] == 1:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    state['owned'] = True
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+
+    def release():
+        with lock:
+            state['users'] -= 1
+            if not state['users'] and state['owned']:
+                tracemalloc.stop()
+                state['owned'] = False
+
+    def memory_profile(method, name):
+        def profiled(*args, **kwargs):
+            acquire()
+            try:
+                before = tracemalloc.take_snapshot()
+                start_size, _ = tracemalloc.get_traced_memory()
+                start = time.time()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    try:
+                        report(name, before, start_size, time.time() - start)
+                    except Exception:
+                        logger.exception('Could not profile the memory of %s'
+                            % name)
+            finally:
+                release()
+        return profiled
+
+    def report(name, before, start_size, duration):
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        diff = after.filter_traces(filters).compare_to(
+            before.filter_traces(filters), 'lineno')
+        net = sum(x.size_diff for x in diff)
+        peak -= start_size
+        if max(peak, net) >= threshold:
+            logger.info('Memory profile of %s (%.3fs): peak %.2f MB, '
+                'net %.2f MB' % (name, duration, peak / 1048576,
+                    net / 1048576))
+            for stat in diff[:entries]:
+                logger.info('    %s' % stat)
+
+    for _, data in to_profile:
+        model, methods = data.split(':')
+        Model = pool.get(model.strip())
+        for method_name in methods.split(','):
+            method_name = method_name.strip()
+            logger.warning('Enabling memory profiling for %s -> %s' % (
+                    Model.__name__, method_name))
+            wrap_model_method(Model, method_name,
+                lambda method, name=method_name: memory_profile(method,
+                    '%s:%s' % (Model.__name__, name)))
+
+
+def activate_line_profile(pool, update):
+    '''
+        Times line by line the overrides of the configured methods. An
+        override is selected by adding "@<module>" to the method name, else
+        all of them are profiled. The calls longer than the threshold are
+        logged as annotated source, and the aggregated timings are available
+        through the "raw_line_profiles" RPC call of
+        "ir.model.debug.model_info" :
+
+            [debug]
+            line_profile_threshold=0.2
+
+            [line_profile]
+            invoice = account.invoice:post@account_invoice_x,validate
+    '''
+    if update:
+        return
+
+    from configparser import NoSectionError
+    from trytond.config import config
+
+    logger = logging.getLogger('trytond.lineprofile')
+    try:
+        to_profile = config.items('line_profile')
+    except NoSectionError:
+        return
+    threshold = config.getfloat('debug', 'line_profile_threshold') or 0
+    ModelInfo = pool.get('ir.model.debug.model_info')
+
+    def line_profile(Model, method_name, codes):
+        def profiled(method):
+            def wrapped(*args, **kwargs):
+                profiler = LineProfiler(codes, Model)
+                start = time.time()
+                try:
+                    return profiler.runcall(method, *args, **kwargs)
+                finally:
+                    duration = time.time() - start
+                    ModelInfo.add_line_profile(Model, method_name, profiler,
+                        duration)
+                    if duration >= threshold:
+                        logger.info('Line profile of %s:%s (%.3fs)' % (
+                                Model.__name__, method_name, duration))
+                        for key, lines in profiler.stats.items():
+                            for line in LineProfiler.format_code(key, lines):
+                                logger.info('    ' + line)
+            return wrapped
+        wrap_model_method(Model, method_name, profiled)
+
+    for _, data in to_profile:
+        model, methods = data.split(':')
+        Model = pool.get(model.strip())
+        for method_name in methods.split(','):
+            method_name, _, module = method_name.strip().partition('@')
+            codes = ModelInfo.get_override_codes(Model, method_name,
+                module or None)
+            if not codes:
+                logger.warning('No override of %s -> %s found%s' % (
+                        Model.__name__, method_name,
+                        ' for module %s' % module if module else ''))
+                continue
+            logger.warning('Enabling line profiling for %s -> %s%s' % (
+                    Model.__name__, method_name,
+                    '@' + module if module else ''))
+            line_profile(Model, method_name, codes)
+
+
 def tryton_syntax_analysis(pool, update):
     if update:
         return
@@ -362,6 +915,27 @@ def detect_api_changes(pool):
 
 
 def enable_debug_views(pool, update):
+    '''
+        Patches fields_view_get to generate a view with all fields of the
+        model when the "developper_view" context key is set.
+
+        Form views are split in notebook pages, and heavy fields (x2many,
+        text, dict, binary and Function fields) are lazy loaded, so that only
+        the fields of the displayed page are read :
+
+            [debug]
+            debug_views=True
+            # Either "kind" (default) or "module"
+            debug_views_group_by=kind
+            debug_views_page_size=40
+
+        When "debug_views_costs" is set, the records read in developer views
+        are read field per field, and the fields labels are annotated with
+        the duration and number of queries of their last read before the
+        view was generated (the client caches the views, so the labels do
+        not follow the later reads). The last costs are available through
+        the "raw_read_costs" RPC call of "ir.model.debug.model_info".
+    '''
     if update:
         return
 
@@ -376,8 +950,43 @@ def enable_debug_views(pool, update):
     from trytond.model import ModelView, ModelSQL, fields
     from trytond.transaction import Transaction
 
+    from .tools import QueryCounter
+
+    group_by = config.get('debug', 'debug_views_group_by') or 'kind'
+    page_size = config.getint('debug', 'debug_views_page_size') or 40
+    kind_pages = [
+        ('main', 'Fields'),
+        ('function', 'Function Fields'),
+        ('relation', 'Relations'),
+        ('text', 'Texts'),
+        ]
+    lazy_types = ('one2many', 'many2many', 'text', 'dict', 'binary')
+    measure_costs = config.getboolean('debug', 'debug_views_costs')
+
     previous_fields_view_get = ModelView.fields_view_get.__func__
 
+    def get_page(cls, fname, field_def):
+        if group_by == 'module':
+            return Pool().get('ir.model.debug.model_info').get_field_module(
+                cls, fname)
+        if isinstance(cls._fields[fname], fields.Function):
+            return 'function'
+        if field_def['type'] in ('one2many', 'many2many'):
+            return 'relation'
+        if field_def['type'] in ('text', 'dict', 'binary'):
+            return 'text'
+        return 'main'
+
+    def page_order(page):
+        if group_by == 'module':
+            return page
+        return [x[0] for x in kind_pages].index(page)
+
+    def page_string(page):
+        if group_by == 'module':
+            return page or 'trytond'
+        return dict(kind_pages)[page]
+
     @classmethod
     def patched_fields_view_get(cls, view_id=None, view_type='form',
             level=None):
@@ -405,7 +1014,7 @@ def enable_debug_views(pool, update):
             fnames += ['rec_name', 'id']
         else:
             res = cls.fields_get()
-            xml += '<form col="2">'
+            pages = defaultdict(list)
             for fname in sorted(res):
                 if res[fname]['type'] in ('timestamp'):
                     continue
@@ -414,32 +1023,109 @@ def enable_debug_views(pool, update):
                     Target = Pool().get(relation)
                     if not issubclass(Target, ModelView):
                         continue
-                if res[fname]['type'] in (
-                        'one2many', 'many2many', 'text', 'dict'):
-                    xml += '<separator name="%s" colspan="2"/>' % fname
-                    xml += '<field name="%s" colspan="2"' % fname
-                    if expand_toolbar:
-                        # expand_toolbar is available
-                        xml += ' height="200" expand_toolbar="0"/>'
-                    else:
-                        xml += ' height="200"/>'
-                else:
-                    xml += '<label name="%s"/><field name="%s"/>' % (
-                        fname, fname)
+                pages[get_page(cls, fname, res[fname])].append(fname)
                 fnames.append(fname)
+            xml += '<form col="2">'
+            xml += '<notebook colspan="2">'
+            for page in sorted(pages, key=page_order):
+                nb_chunks = (len(pages[page]) - 1) // page_size + 1
+                for chunk in range(nb_chunks):
+                    string = page_string(page)
+                    if nb_chunks > 1:
+                        string += ' (%i/%i)' % (chunk + 1, nb_chunks)
+                    xml += '<page string="%s" id="%s_%i" col="2">' % (
+                        string, page or 'trytond', chunk)
+                    for fname in pages[page][
+                            chunk * page_size:(chunk + 1) * page_size]:
+                        if res[fname]['type'] in (
+                                'one2many', 'many2many', 'text', 'dict'):
+                            xml += '<separator name="%s" colspan="2"/>' % (
+                                fname)
+                            xml += '<field name="%s" colspan="2"' % fname
+                            if expand_toolbar:
+                                # expand_toolbar is available
+                                xml += ' height="200" expand_toolbar="0"/>'
+                            else:
+                                xml += ' height="200"/>'
+                        else:
+                            xml += '<label name="%s"/><field name="%s"/>' % (
+                                fname, fname)
+                    xml += '</page>'
+            xml += '</notebook>'
             xml += '</form>'
         result['arch'] = xml
         result['fields'] = cls.fields_get(fnames)
+        if measure_costs:
+            read_costs = Pool().get('ir.model.debug.model_info'
+                ).get_read_costs(cls.__name__)[cls.__name__]
+        else:
+            read_costs = {}
         for fname in fnames:
             name = result['fields'][fname]['string'] + ' (%s)' % fname
+            tags = []
             if issubclass(type(cls._fields[fname]), fields.Function):
-                name += ' [Function]'
+                tags.append('Function')
+            if fname in read_costs:
+                duration, nb_queries = read_costs[fname]
+                tags += ['%ims' % (duration * 1000), '%i queries' % nb_queries]
+                # The view is generated (and cached by the client) before
+                # the record is read
+                result['fields'][fname]['help'] = '\n\n'.join(filter(None, [
+                            result['fields'][fname].get('help'),
+                            'The read cost in the label is the one of the '
+                            'last read before this view was loaded, the '
+                            'current costs are returned by the '
+                            '"raw_read_costs" RPC call of '
+                            '"ir.model.debug.model_info".']))
+            if tags:
+                name += ' [%s]' % ', '.join(tags)
             result['fields'][fname].update({
                     'string': name,
                     'states': {'readonly': True},
                     'on_change': [],
                     'on_change_with': [],
                     })
+            if (result['fields'][fname]['type'] in lazy_types or
+                    isinstance(cls._fields[fname], fields.Function)):
+                result['fields'][fname]['loading'] = 'lazy'
         return result
 
     setattr(ModelView, 'fields_view_get', patched_fields_view_get)
+
+    def measure_read_costs(klass):
+        previous_read = klass.read.__func__
+
+        @classmethod
+        def patched_read(cls, ids, fields_names, *args, **kwargs):
+            if (not Transaction().context.get('developper_view') or not ids
+                    or not fields_names):
+                return previous_read(cls, ids, fields_names, *args, **kwargs)
+            groups = defaultdict(list)
+            for fname in fields_names:
+                root = fname.split('.')[0]
+                if root == 'id' or root not in cls._fields:
+                    root = None
+                groups[root].append(fname)
+            ModelInfo = Pool().get('ir.model.debug.model_info')
+            order, rows = [], {}
+            for root, names in groups.items():
+                with QueryCounter() as counter:
+                    start = time.time()
+                    values = previous_read(cls, ids, names, *args, **kwargs)
+                    end = time.time()
+                if root is not None:
+                    ModelInfo.add_read_cost(cls.__name__, root, end - start,
+                        counter.queries)
+                for value in values:
+                    if value['id'] not in rows:
+                        order.append(value['id'])
+                        rows[value['id']] = {}
+                    rows[value['id']].update(value)
+            return [rows[x] for x in order]
+        setattr(klass, 'read', patched_read)
+
+    if measure_costs:
+        logger.warning('Measuring read costs in debugging views')
+        for klass in pool._pool[pool.database_name].get('model', {}).values():
+            if issubclass(klass, ModelSQL):
+                measure_read_costs(klass)
@@ -0,0 +1,162 @@
+# This file is part of Coog. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import sys
+import json
+import time
+import logging
+
+from .tools import QueryCounter
+
+__all__ = [
+    'survey',
+    'format_survey',
+    ]
+
+logger = logging.getLogger('trytond.benchmark')
+
+
+def _timed(function, *args, **kwargs):
+    with QueryCounter() as counter:
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        duration = time.perf_counter() - start
+    return result, duration, counter.queries
+
+
+def survey_model(model_name, limit=100):
+    '''
+        Runs the generated workloads for a model : search the first records,
+        read all their stored fields, read each Function field, and search
+        on each indexed field.
+    '''
+    from trytond.pool import Pool
+    from trytond.model import fields
+
+    pool = Pool()
+    ModelInfo = pool.get('ir.model.debug.model_info')
+    Model = pool.get(model_name)
+    infos = {name: ModelInfo.raw_field_info(Model, name)
+        for name in Model._fields}
+    stored = [x for x, info in infos.items() if not info['is_function']]
+    functions = [x for x, info in infos.items() if info['is_function']]
+    indexed = [x for x in stored if getattr(Model._fields[x], 'select', False)
+        and not isinstance(Model._fields[x], (fields.One2Many,
+                fields.Many2Many))]
+
+    result = {'model': model_name, 'fields': {}, 'searches': {}}
+    records, result['search'], result['search_queries'] = _timed(
+        Model.search, [], limit=limit)
+    ids = [x.id for x in records]
+    result['records'] = len(ids)
+
+    values, result['read'], result['read_queries'] = _timed(
+        Model.read, ids, stored)
+    result['read_rate'] = len(ids) / result['read'] if result['read'] else 0
+
+    for fname in functions:
+        try:
+            _, duration, queries = _timed(Model.read, ids, [fname])
+            result['fields'][fname] = {
+                'duration': duration,
+                'queries': queries,
+                'per_record': duration / len(ids) if ids else 0,
+                }
+        except Exception as exc:
+            result['fields'][fname] = {'error': str(exc)}
+
+    for fname in indexed:
+        value = next((x[fname] for x in values if x.get(fname) is not None),
+            None)
+        if value is None:
+            continue
+        try:
+            _, duration, queries = _timed(Model.search, [(fname, '=', value)])
+            result['searches'][fname] = {
+                'duration': duration,
+                'queries': queries,
+                }
+        except Exception as exc:
+            result['searches'][fname] = {'error': str(exc)}
+    result['function_read'] = sum(x.get('duration', 0)
+        for x in result['fields'].values())
+    result['indexed_search'] = sum(x.get('duration', 0)
+        for x in result['searches'].values())
+    result['total'] = (result['search'] + result['read'] +
+        result['function_read'] + result['indexed_search'])
+    return result
+
+
+def survey(models=None, limit=100):
+    '''
+        Runs the generated read / search workloads on models (all ModelSQL
+        by default) in the current transaction, which is rolled back after
+        each model, and returns the results, slowest models first
+    '''
+    from trytond.pool import Pool
+    from trytond.model import ModelSQL
+    from trytond.transaction import Transaction
+
+    pool = Pool()
+    if models is None:
+        models = sorted(name for name, Model in pool.iterobject()
+            if issubclass(Model, ModelSQL))
+    results = []
+    for model_name in models:
+        logger.info('Surveying %s' % model_name)
+        try:
+            results.append(survey_model(model_name, limit))
+        except Exception as exc:
+            results.append({'model': model_name, 'error': str(exc),
+                    'total': 0})
+        finally:
+            Transaction().rollback()
+    return sorted(results, key=lambda x: x['total'], reverse=True)
+
+
+def format_survey(results, nb_fields=20):
+    lines = ['%-40s %7s %10s %10s %12s %12s %10s %10s' % ('model',
+            'records', 'search', 'read', 'records/s', 'functions', 'indexed',
+            'total')]
+    slowest_fields = []
+    for data in results:
+        if 'error' in data:
+            lines.append('%-40s ERROR %s' % (data['model'], data['error']))
+            continue
+        lines.append('%-40s %7i %8.1fms %8.1fms %12.0f %10.1fms %8.1fms '
+            '%8.1fms' % (data['model'], data['records'],
+                data['search'] * 1000, data['read'] * 1000, data['read_rate'],
+                data['function_read'] * 1000, data['indexed_search'] * 1000,
+                data['total'] * 1000))
+        for fname, field_data in data['fields'].items():
+            if 'error' not in field_data:
+                slowest_fields.append((field_data['duration'],
+                        data['model'], fname, field_data))
+    slowest_fields.sort(reverse=True)
+    lines.append('')
+    lines.append('%-60s %10s %12s %8s' % ('slowest fields', 'duration',
+            'per record', 'queries'))
+    for duration, model_name, fname, field_data in slowest_fields[:nb_fields]:
+        lines.append('%-60s %8.1fms %10.2fms %8i' % (
+                '%s.%s' % (model_name, fname), duration * 1000,
+                field_data['per_record'] * 1000, field_data['queries']))
+    return lines
+
+
+def run(options):
+    '''
+        Surveys the database of the trytond-debug-survey script options, and
+        prints the results
+    '''
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    Pool(options.database).init()
+    with Transaction().start(options.database, 0) as transaction:
+        try:
+            results = survey(options.models, options.limit)
+        finally:
+            transaction.rollback()
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    sys.stdout.write('\n'.join(format_survey(results, options.fields)) + '\n')
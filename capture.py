@@ -0,0 +1,203 @@
+# This file is part of Coog. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import os
+import re
+import sys
+import json
+import time
+import pstats
+import cProfile
+import tempfile
+import logging
+import itertools
+from io import StringIO
+
+__all__ = [
+    'capture_call',
+    'load_capture',
+    'replay_capture',
+    ]
+
+logger = logging.getLogger('trytond.autoprofile')
+_counter = itertools.count()
+
+
+def _compact(value):
+    '''
+        Replaces records and lists of records by markers holding their model
+        and ids, and sets by lists
+    '''
+    from trytond.model import Model
+    if isinstance(value, Model):
+        return {'__class__': 'debug.record', 'model': value.__name__,
+            'id': value.id}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        if value and all(isinstance(x, Model) for x in value):
+            models = {x.__name__ for x in value}
+            if len(models) == 1:
+                return {'__class__': 'debug.records', 'model': models.pop(),
+                    'ids': [x.id for x in value]}
+        return [_compact(x) for x in value]
+    if isinstance(value, dict):
+        return {k: _compact(v) for k, v in value.items()}
+    return value
+
+
+def _summary(value, result=None):
+    '''
+        Returns a short description of the records and domains in value
+    '''
+    if result is None:
+        result = []
+    if isinstance(value, dict):
+        if value.get('__class__') == 'debug.records':
+            result.append('%s x %i' % (value['model'], len(value['ids'])))
+        elif value.get('__class__') == 'debug.record':
+            result.append('%s,%s' % (value['model'], value['id']))
+        else:
+            for sub_value in value.values():
+                _summary(sub_value, result)
+    elif isinstance(value, list):
+        if any(isinstance(x, list) and len(x) >= 3 and isinstance(x[0], str)
+                for x in value):
+            result.append('domain %s' % json.dumps(value, default=str)[:200])
+        else:
+            for sub_value in value:
+                _summary(sub_value, result)
+    return result
+
+
+def capture_call(directory, model_name, method_name, args, kwargs,
+        duration):
+    '''
+        Writes the arguments, context and user of a call to a JSON file of
+        directory, which can be replayed with replay_capture, and returns its
+        path. Records are saved as model / ids.
+    '''
+    from trytond.protocols.jsonrpc import JSONEncoder
+    from trytond.transaction import Transaction
+
+    class CaptureEncoder(JSONEncoder):
+        def default(self, obj):
+            try:
+                return super(CaptureEncoder, self).default(obj)
+            except TypeError:
+                # Will not be replayable, but still useful to understand
+                return {'__class__': 'debug.repr', 'repr': repr(obj)}
+
+    transaction = Transaction()
+    data = {
+        'database': transaction.database.name
+        if transaction.database else None,
+        'user': transaction.user,
+        'context': _compact(dict(transaction.context)),
+        'model': model_name,
+        'method': method_name,
+        'args': [_compact(x) for x in args],
+        'kwargs': _compact(kwargs),
+        'duration': duration,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+    data['summary'] = _summary([data['args'], data['kwargs']])
+    path = os.path.join(directory, 'capture-%s-%s-%s-%s.json' % (
+            re.sub(r'[^A-Za-z0-9]+', '_', '%s-%s' % (model_name,
+                    method_name)),
+            time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(_counter)))
+    # Serialize first and rename a complete temporary file, so a failure
+    # never leaves a partial capture behind
+    content = json.dumps(data, cls=CaptureEncoder, indent=1)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def load_capture(path):
+    '''
+        Reads a capture, records are decoded as instances, so this must be
+        called in a transaction on the captured database
+    '''
+    from trytond.pool import Pool
+    from trytond.protocols.jsonrpc import JSONDecoder
+
+    pool = Pool()
+    decoder = JSONDecoder()
+
+    def object_hook(dct):
+        if dct.get('__class__') == 'debug.record':
+            return pool.get(dct['model'])(dct['id'])
+        if dct.get('__class__') == 'debug.records':
+            return pool.get(dct['model']).browse(dct['ids'])
+        if dct.get('__class__') == 'debug.repr':
+            logger.warning('Argument %s could not be captured' % dct['repr'])
+            return dct['repr']
+        return decoder(dct)
+
+    with open(path, 'r') as f:
+        return json.load(f, object_hook=object_hook)
+
+
+def replay_capture(path, database=None, profile=True, sort='cumulative',
+        entries=40):
+    '''
+        Re-executes a captured call in a transaction which is rolled back,
+        under the profiler if profile is set. Returns the duration and the
+        profiler report.
+    '''
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    with open(path, 'r') as f:
+        header = json.load(f)
+    database = database or header['database']
+    Pool(database).init()
+    with Transaction().start(database, header['user'],
+            context=header['context']) as transaction:
+        try:
+            data = load_capture(path)
+            # Do not profile or capture the call again if the method is
+            # auto profiled
+            with transaction.set_context(data['context'], _debug_replay=True):
+                Model = Pool().get(data['model'])
+                args, kwargs = data['args'], data['kwargs']
+                method = getattr(Model, data['method'])
+                if args and isinstance(args[0], Model):
+                    # Instance method, the first argument is the record
+                    method = getattr(args[0], data['method'])
+                    args = args[1:]
+                profiler = cProfile.Profile() if profile else None
+                start = time.time()
+                if profiler:
+                    profiler.runcall(method, *args, **kwargs)
+                else:
+                    method(*args, **kwargs)
+                duration = time.time() - start
+        finally:
+            transaction.rollback()
+    report = ''
+    if profiler:
+        stream = StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats(*sort.split(','))
+        stats.print_stats(entries)
+        report = stream.getvalue()
+    return duration, report
+
+
+def run(options):
+    '''
+        Replays the capture of the trytond-debug-replay script options, and
+        prints the profiler report
+    '''
+    with open(options.capture, 'r') as f:
+        captured_duration = json.load(f)['duration']
+    duration, report = replay_capture(options.capture, options.database,
+        options.profile, options.sort, options.entries)
+    print('Replayed %s in %.3fs (was %.3fs)' % (options.capture, duration,
+            captured_duration))
+    sys.stdout.write(report)
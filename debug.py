@@ -1,18 +1,34 @@
 # This file is part of Coog. The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 import os
+import time
 import inspect
+import cProfile
+import pstats
 from collections import defaultdict
+from io import StringIO
 import pprint
 import logging
+import statistics
+import threading
+from bisect import bisect_left
+from itertools import islice
 
+from sql.functions import CurrentTimestamp
+
+from trytond.cache import Cache
 from trytond.wizard import Wizard, StateTransition, StateView, Button
 from trytond.config import config
 from trytond.rpc import RPC
 from trytond.model import ModelSQL, ModelView, fields
 from trytond.transaction import Transaction
 from trytond.pool import Pool
-from trytond.pyson import Eval, Bool
+from trytond.tools import grouped_slice
+from trytond import pyson
+from trytond.pyson import Eval, Bool, PYSONEncoder, PYSONDecoder
+
+from .tools import (QueryCounter, StartupCosts, CacheStats, SearchStats,
+    Metrics, LineProfiler, OverrideProfiler, deep_sizeof, INDEXABLE_OPERATORS)
 
 logger = logging.getLogger(__name__)
 METHOD_TEMPLATES = ['default_', 'on_change_with_', 'on_change_', 'order_']
@@ -31,13 +47,73 @@ __all__ = [
     'DebugViewInstance',
     'DebugOnChangeRelation',
     'DebugOnChangeWithRelation',
+    'DebugIndexInstance',
     'RefreshDebugData',
     'OpenInitialFrame',
     ]
 
 
 _FIELDS = ['model_name', 'id_to_calculate', 'to_evaluate',
-    'must_raise_exception', 'previous_runs']
+    'must_raise_exception', 'profile_evaluation', 'benchmark_runs',
+    'benchmark_warmup', 'benchmark_clear_cache', 'previous_runs']
+
+
+class _Truncated(object):
+    '''
+        Marker of the items removed from a result, rendered without quotes
+    '''
+    def __init__(self, description):
+        self.description = description
+
+    def __repr__(self):
+        return '...' + (' (%s)' % self.description if self.description
+            else '')
+
+
+class _EvaluatedInstance(object):
+    '''
+        Proxy of the instance of the evaluated expressions, whose "search"
+        returns at most search_limit records when no limit is given, so that
+        "instance.search([])" does not read a whole table
+    '''
+    def __init__(self, record, search_limit):
+        object.__setattr__(self, '_record', record)
+        object.__setattr__(self, '_search_limit', search_limit)
+
+    @property
+    def __class__(self):
+        return self._record.__class__
+
+    def __getattr__(self, name):
+        return getattr(self._record, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._record, name, value)
+
+    def search(self, domain, offset=0, limit=None, *args, **kwargs):
+        count = kwargs.get('count', args[1] if len(args) > 1 else False)
+        if limit is None and not count:
+            limit = self._search_limit
+        return self._record.search(domain, offset, limit, *args, **kwargs)
+
+    def __int__(self):
+        return int(self._record)
+
+    def __eq__(self, other):
+        return self._record == other
+
+    def __ne__(self, other):
+        return self._record != other
+
+    def __hash__(self):
+        return hash(self._record)
+
+    def __repr__(self):
+        return repr(self._record)
+
+    def __str__(self):
+        return str(self._record)
+
 
 def open_path(rel_path, patterns):
     import trytond
@@ -94,6 +170,7 @@ class FieldInfo(ModelView):
     field_domain = fields.Text('Domain')
     id_to_calculate = fields.Integer('Id To Calculate')
     calculated_value = fields.Char('Calculated Value')
+    calculation_time = fields.Integer('Calculation Time (ms)')
 
 
 class ModelInfo(ModelView):
@@ -118,21 +195,63 @@ class ModelInfo(ModelView):
             'invisible': ~Bool(Eval('id_to_calculate', False))},
         readonly=True, depends=['id_to_calculate'])
     must_raise_exception = fields.Boolean('Must Raise Exception')
+    profile_evaluation = fields.Boolean('Profile Evaluation',
+        help='Add the profiling of the evaluation to the previous runs')
+    benchmark_runs = fields.Integer('Benchmark Runs',
+        domain=['OR',
+            ('benchmark_runs', '=', None),
+            ('benchmark_runs', '>=', 1),
+            ],
+        help='Number of evaluations of the expression run by the Benchmark '
+        'button, the distribution of the runs durations will be added to the '
+        'previous runs')
+    benchmark_warmup = fields.Integer('Warm-up Runs',
+        domain=['OR',
+            ('benchmark_warmup', '=', None),
+            ('benchmark_warmup', '>=', 0),
+            ],
+        help='Number of evaluations to run before the benchmark runs',
+        states={'invisible': ~Eval('benchmark_runs')},
+        depends=['benchmark_runs'])
+    benchmark_clear_cache = fields.Boolean('Clear Cache',
+        help='Clear the transaction cache before each benchmark run',
+        states={'invisible': ~Eval('benchmark_runs')},
+        depends=['benchmark_runs'])
     previous_runs = fields.Text('Previous runs', states={
             'invisible': ~Bool(Eval('id_to_calculate', False))},
         readonly=True, depends=['id_to_calculate'])
+    _attribute_index_cache = Cache('ir.model.debug.model_info.attributes',
+        context=False)
+    _override_stats = {}
+    _override_stats_lock = threading.Lock()
+    _line_stats = {}
+    _read_costs = defaultdict(dict)
+    _read_costs_lock = threading.Lock()
 
     @classmethod
     def __setup__(cls):
         super(ModelInfo, cls).__setup__()
         cls.__rpc__.update({
                 'raw_model_infos': RPC(),
+                'raw_memory_infos': RPC(),
                 'raw_module_infos': RPC(),
                 'raw_field_infos': RPC(),
+                'raw_pyson_infos': RPC(),
+                'raw_override_costs': RPC(),
+                'raw_line_profiles': RPC(),
+                'raw_startup_costs': RPC(),
+                'raw_cache_stats': RPC(),
+                'raw_metrics': RPC(),
+                'raw_search_stats': RPC(),
+                'raw_read_costs': RPC(),
+                'advise_indexes': RPC(),
                 })
         cls._buttons.update({
                 'follow_link': {},
                 'refresh': {},
+                'run_benchmark': {
+                    'invisible': ~Eval('benchmark_runs'),
+                    },
                 })
 
     @classmethod
@@ -155,16 +274,7 @@ class ModelInfo(ModelView):
             info.is_function = False
             real_field = field
         info.kind = real_field.__class__.__name__
-        if isinstance(field, (fields.Many2One, fields.One2Many)):
-            info.target_model = field.model_name
-        elif isinstance(field, fields.Many2Many):
-            if field.target:
-                info.target_model = Pool().get(field.relation_name)._fields[
-                    field.target].model_name
-            else:
-                info.target_model = field.relation_name
-        else:
-            info.target_model = ''
+        info.target_model = self.get_target_model(field) or ''
         for elem in ('required', 'readonly', 'invisible'):
             setattr(info, 'is_%s' % elem, getattr(field, elem, False))
             setattr(info, 'state_%s' % elem, repr(field.states.get(elem, {})))
@@ -202,6 +312,21 @@ class ModelInfo(ModelView):
 
     @ModelView.button_change(*_FIELDS)
     def refresh(self):
+        self.run_evaluation()
+
+    @ModelView.button_change(*_FIELDS)
+    def run_benchmark(self):
+        self.run_evaluation(benchmark=True)
+
+    def run_evaluation(self, benchmark=False):
+        '''
+            Evaluates the expression (benchmark_runs times if benchmark is
+            set), and adds its statistics to the previous runs, which are
+            limited to the last ones :
+
+                [debug]
+                evaluation_history_size=10
+        '''
         if not self.to_evaluate:
             self.evaluation_result = ''
             return
@@ -210,33 +335,199 @@ class ModelInfo(ModelView):
             self.previous_runs = ''
             return
         if self.previous_runs:
-            previous_runs = self.previous_runs[1:].split('\n\n')
+            previous_runs = self.previous_runs.split('\n\n')
         else:
             previous_runs = ['']
-        if previous_runs[0] != self.to_evaluate:
-            self.previous_runs = '\n\n'.join(
-                ['# %s (%i)\n%s' % (self.model_name, self.id_to_calculate,
-                        self.to_evaluate)] + [x for x in previous_runs if x])
+        stats = {}
         try:
-            self.evaluation_result = pprint.pformat(self.evaluate())
+            if benchmark and (self.benchmark_runs or 0) >= 1:
+                result = self.benchmark(stats)
+            else:
+                result = self.evaluate_with_stats(stats,
+                    self.profile_evaluation)
+            self.evaluation_result = self.format_result(result)
         except Exception as exc:
             if self.must_raise_exception:
                 raise
             self.evaluation_result = 'ERROR: %s' % str(exc)
+        # The last run of an expression replaces its previous ones
+        header = '# %s (%i)\n%s\n' % (self.model_name, self.id_to_calculate,
+            self.to_evaluate)
+        previous_runs = [x for x in previous_runs
+            if x and not x.startswith(header)]
+        self.previous_runs = '\n\n'.join(
+            ([header + self.format_stats(stats)] + previous_runs)[
+                :config.getint('debug', 'evaluation_history_size',
+                    default=10)])
 
     @fields.depends(*_FIELDS)
     def on_change_to_evaluate(self):
         self.refresh()
 
     def evaluate(self):
+        '''
+            Evaluates the expression, "instance.search" returning at most
+            evaluation_search_limit records when called without limit :
+
+                [debug]
+                evaluation_search_limit=1000
+        '''
+        instance = Pool().get(self.model_name)(self.id_to_calculate)
         context = {
-            'instance': Pool().get(self.model_name)(self.id_to_calculate),
+            'instance': _EvaluatedInstance(instance, config.getint('debug',
+                    'evaluation_search_limit', default=1000)),
             }
-        return eval(self.to_evaluate, context)
+        result = eval(self.to_evaluate, context)
+        if isinstance(result, _EvaluatedInstance):
+            return result._record
+        return result
+
+    def evaluate_with_stats(self, stats, profile=False):
+        '''
+            Evaluates the expression, and stores in stats the wall / cpu
+            time, number of queries and fetched rows, and optionally the
+            profiling of the evaluation :
+
+                [debug]
+                evaluation_profile_entries=20
+        '''
+        profiler = cProfile.Profile() if profile else None
+        with QueryCounter() as counter:
+            start, cpu_start = time.time(), time.thread_time()
+            try:
+                if profiler:
+                    return profiler.runcall(self.evaluate)
+                return self.evaluate()
+            finally:
+                stats['wall'] = time.time() - start
+                stats['cpu'] = time.thread_time() - cpu_start
+                stats['queries'] = counter.queries
+                stats['rows'] = counter.rows
+                if profiler:
+                    output = StringIO()
+                    pstats.Stats(profiler, stream=output).sort_stats(
+                        'cumulative').print_stats(config.getint('debug',
+                            'evaluation_profile_entries', default=20))
+                    stats['profile'] = output.getvalue()
+
+    def benchmark(self, stats):
+        '''
+            Evaluates the expression benchmark_runs times (at least once),
+            after benchmark_warmup evaluations, and stores in stats the
+            statistics of each run
+        '''
+        stats['runs'] = []
+        stats['warmup'] = max(self.benchmark_warmup or 0, 0)
+        stats['clear_cache'] = bool(self.benchmark_clear_cache)
+        for idx in range(stats['warmup'] + max(self.benchmark_runs or 0, 1)):
+            if self.benchmark_clear_cache:
+                Transaction().cache.clear()
+            run_stats = {}
+            result = self.evaluate_with_stats(run_stats)
+            if idx >= stats['warmup']:
+                stats['runs'].append(run_stats)
+        return result
+
+    @classmethod
+    def format_result(cls, result):
+        '''
+            Formats the result of an evaluation, only rendering the first
+            items of collections / iterators (at any depth), down to a
+            maximum depth, and truncating the output :
+
+                [debug]
+                evaluation_max_items=100
+                evaluation_max_depth=6
+                evaluation_max_size=10000
+        '''
+        max_items = config.getint('debug', 'evaluation_max_items',
+            default=100)
+        max_depth = config.getint('debug', 'evaluation_max_depth',
+            default=6)
+        max_size = config.getint('debug', 'evaluation_max_size',
+            default=10000)
+        header = ''
+        if isinstance(result, (list, tuple, set, frozenset, dict)):
+            if len(result) > max_items:
+                header = '# %i items, showing the first %i\n' % (
+                    len(result), max_items)
+        elif hasattr(result, '__next__'):
+            preview = list(islice(result, max_items + 1))
+            if len(preview) > max_items:
+                header = '# More than %i items, showing the first %i\n' % (
+                    max_items, max_items)
+            result = preview[:max_items]
+        output = pprint.pformat(cls.truncate_result(result, max_items,
+                max_depth, max_size))
+        if len(output) > max_size:
+            output = output[:max_size] + '\n... (%i characters truncated)' % (
+                len(output) - max_size)
+        return header + output
+
+    @classmethod
+    def truncate_result(cls, value, max_items, max_depth, max_size):
+        '''
+            Returns a copy of value whose collections hold at most max_items
+            items (the remaining ones being replaced by a marker), nested at
+            most max_depth times, and whose strings are shorter than max_size
+        '''
+        if isinstance(value, (str, bytes)):
+            if len(value) > max_size:
+                return value[:max_size]
+            return value
+        if not isinstance(value, (list, tuple, set, frozenset, dict)):
+            return value
+        if max_depth <= 0:
+            return _Truncated('%s of %i items' % (type(value).__name__,
+                    len(value)))
+        more = len(value) - max_items
+        if isinstance(value, dict):
+            result = {k: cls.truncate_result(v, max_items, max_depth - 1,
+                    max_size) for k, v in islice(value.items(), max_items)}
+            if more > 0:
+                result[_Truncated('%i more items' % more)] = _Truncated('')
+            return result
+        items = [cls.truncate_result(x, max_items, max_depth - 1, max_size)
+            for x in islice(value, max_items)]
+        if more > 0:
+            items.append(_Truncated('%i more items' % more))
+        if isinstance(value, (list, tuple)):
+            return type(value)(items)
+        return set(items)
+
+    @classmethod
+    def format_stats(cls, stats):
+        if 'runs' in stats:
+            return cls.format_benchmark_stats(stats)
+        lines = ['# %.1fms wall, %.1fms cpu, %i queries, %i rows' % (
+                stats['wall'] * 1000, stats['cpu'] * 1000, stats['queries'],
+                stats['rows'])]
+        lines += ['#   ' + x for x in stats.get('profile', '').split('\n')
+            if x.strip()]
+        return '\n'.join(lines)
+
+    @classmethod
+    def format_benchmark_stats(cls, stats):
+        runs = stats['runs']
+        if not runs:
+            return '# No benchmark run completed'
+        lines = ['# %i runs (%i warm-up%s)' % (len(runs), stats['warmup'],
+                ', cache cleared' if stats['clear_cache'] else '')]
+        for key, template in [('wall', '%.1fms'), ('cpu', '%.1fms'),
+                ('queries', '%g'), ('rows', '%g')]:
+            factor = 1000 if template.endswith('ms') else 1
+            values = [x[key] * factor for x in runs]
+            lines.append(('# %s: min ' + template + ' / median ' + template +
+                    ' / max ' + template) % (key, min(values),
+                    statistics.median(values), max(values)))
+        lines.append('# runs (ms): %s' % ', '.join(
+                '%.1f' % (x['wall'] * 1000) for x in runs))
+        return '\n'.join(lines)
 
     @ModelView.button_change('model_name', 'id_to_calculate', 'to_evaluate',
-        'must_raise_exception', 'previous_runs', 'hide_functions',
-        'filter_value', 'field_infos')
+        'must_raise_exception', 'profile_evaluation', 'benchmark_runs',
+        'benchmark_warmup', 'benchmark_clear_cache', 'previous_runs',
+        'hide_functions', 'filter_value', 'field_infos')
     def follow_link(self):
         try:
             target = self.evaluate()
@@ -261,12 +552,58 @@ class ModelInfo(ModelView):
             [x for x in all_fields_infos if x is not None],
             key=lambda x: getattr(x, self.filter_value))
         if self.id_to_calculate:
-            for field in self.field_infos:
-                try:
-                    field.calculated_value = str(getattr(
-                            TargetModel(self.id_to_calculate), field.name))
-                except Exception as exc:
-                    field.calculated_value = 'ERROR: %s' % str(exc)
+            self.calculate_values(TargetModel)
+
+    def calculate_values(self, TargetModel):
+        '''
+            Stored fields are read in one batch, Function fields are read one
+            by one in order to time them. Once the total time budget of the
+            Function fields is exhausted, the remaining ones are not
+            calculated. The budget is checked between fields, so a running
+            getter is never interrupted :
+
+                [debug]
+                calculated_values_total_budget=5
+        '''
+        budget = config.getfloat('debug', 'calculated_values_total_budget',
+            default=5)
+
+        def format_value(info, value):
+            if info.target_model and isinstance(value, int):
+                return '%s,%s' % (info.target_model, value)
+            if isinstance(value, tuple):
+                value = list(value)
+            return str(value)
+
+        def read_values(infos):
+            if not infos:
+                return
+            start = time.time()
+            try:
+                values = TargetModel.read([self.id_to_calculate],
+                    [x.name for x in infos])[0]
+            except Exception as exc:
+                if len(infos) > 1:
+                    for info in infos:
+                        read_values([info])
+                    return
+                infos[0].calculated_value = 'ERROR: %s' % str(exc)
+            else:
+                for info in infos:
+                    info.calculated_value = format_value(
+                        info, values[info.name])
+                    info.calculation_time = None
+            if len(infos) == 1:
+                infos[0].calculation_time = int(
+                    (time.time() - start) * 1000)
+
+        read_values([x for x in self.field_infos if not x.is_function])
+        start = time.time()
+        for info in [x for x in self.field_infos if x.is_function]:
+            if time.time() - start > budget:
+                info.calculated_value = 'SKIPPED: total time budget exceeded'
+                continue
+            read_values([info])
 
     @classmethod
     def raw_field_info(cls, base_model, field_name):
@@ -287,14 +624,9 @@ class ModelInfo(ModelView):
                 result['searcher'] = field.searcher
             field = field._field
         result['kind'] = field.__class__.__name__
-        if isinstance(field, (fields.Many2One, fields.One2Many)):
-            result['target_model'] = field.model_name
-        elif isinstance(field, fields.Many2Many):
-            if field.target:
-                result['target_model'] = Pool().get(
-                    field.relation_name)._fields[field.target].model_name
-            else:
-                result['target_model'] = field.relation_name
+        target_model = cls.get_target_model(field)
+        if target_model:
+            result['target_model'] = target_model
         if isinstance(field, fields.Selection):
             if isinstance(field.selection, str):
                 result['selection_method'] = field.selection
@@ -310,16 +642,33 @@ class ModelInfo(ModelView):
         result['has_domain'] = bool(field_domain)
         if field_domain:
             result['domain'] = repr(field_domain)
-        result['module'] = ''
+        result['module'] = cls.get_field_module(base_model, field_name)
+        return result
+
+    @classmethod
+    def get_target_model(cls, field):
+        if isinstance(field, fields.Function):
+            field = field._field
+        if isinstance(field, (fields.Many2One, fields.One2Many)):
+            return field.model_name
+        elif isinstance(field, fields.Many2Many):
+            if field.target:
+                return Pool().get(field.relation_name)._fields[
+                    field.target].model_name
+            return field.relation_name
+
+    @classmethod
+    def get_field_module(cls, base_model, field_name):
+        module = ''
         for frame in base_model.__mro__[::-1]:
             full_name = str(frame)[8:-2].split('.')
             if len(full_name) < 2:
                 continue
             if full_name[1] == 'modules':
-                result['module'] = full_name[2]
+                module = full_name[2]
             if getattr(frame, field_name, None) is not None:
                 break
-        return result
+        return module
 
     @classmethod
     def raw_field_infos(cls, models=None):
@@ -335,6 +684,70 @@ class ModelInfo(ModelView):
                     base_model, fname)
         return infos
 
+    @classmethod
+    def raw_pyson_infos(cls, expressions=None, models=None, min_size=0):
+        '''
+            Encodes and validates PYSON, and returns the encoded sizes and
+            errors, largest first.
+
+            If expressions (python PYSON strings) are given, they are checked,
+            else the fields states / domain / context, view attributes and
+            buttons states of the models (all by default) are.
+        '''
+        encoder = PYSONEncoder()
+        decoder = PYSONDecoder(noeval=True)
+        result = []
+
+        def check(value, **info):
+            info.setdefault('error', '')
+            info['size'] = 0
+            if not info['error']:
+                try:
+                    encoded = encoder.encode(value)
+                    decoder.decode(encoded)
+                    info['size'] = len(encoded)
+                except Exception as exc:
+                    info['error'] = str(exc)
+            if info['error'] or info['size'] >= min_size:
+                result.append(info)
+
+        if expressions is not None:
+            for expression in expressions:
+                try:
+                    value, error = eval(expression, dict(pyson.CONTEXT)), ''
+                except Exception as exc:
+                    value, error = None, str(exc)
+                check(value, kind='expression', name=expression, error=error)
+            return sorted(result, key=lambda x: x['size'], reverse=True)
+
+        pool = Pool()
+        if models is None:
+            models = [x[0] for x in cls.get_possible_model_names()]
+        for model_name in models:
+            Model = pool.get(model_name)
+            for fname, field in Model._fields.items():
+                for attribute in ('states', 'domain', 'context'):
+                    value = getattr(field, attribute, None)
+                    if value:
+                        check(value, model=model_name, kind='field',
+                            name=fname, attribute=attribute)
+            if not issubclass(Model, ModelView):
+                continue
+            try:
+                view_attributes = Model.view_attributes()
+            except Exception as exc:
+                view_attributes = []
+                check(None, model=model_name, kind='view', name='',
+                    attribute='', error=str(exc))
+            for xpath, attribute, value, *extra in view_attributes:
+                check(value, model=model_name, kind='view', name=xpath,
+                    attribute=attribute)
+            for button, definition in Model._buttons.items():
+                if definition.get('states'):
+                    check(definition['states'], model=model_name,
+                        kind='button', name=button, attribute='states')
+        return sorted(result, key=lambda x: x['size'], reverse=True)
+
     @classmethod
     def extract_mro(cls, model_class, model_name):
         result, methods, first_occurence = {}, {}, False
@@ -413,6 +826,330 @@ class ModelInfo(ModelView):
             methods.pop(mname)
         return result, methods
 
+    @classmethod
+    def extract_override_frames(cls, model_class, method_name):
+        '''
+            Returns the classes of the mro of model_class defining
+            method_name, from the most specific to the initial one. The
+            module of the classes of the trytond "ir" and "res" packages is
+            the package name, as for the other modules.
+        '''
+        frames = []
+        for line in model_class.__mro__:
+            func = line.__dict__.get(method_name, None)
+            if func is None:
+                continue
+            full_name = str(line)[8:-2].split('.')
+            if full_name[1] == 'pool':
+                continue
+            # classmethod / staticmethod / dualmethod
+            func = getattr(func, '__func__', getattr(func, 'func', func))
+            # Methods wrapped by the debug module (see wrap_model_method) hold
+            # the method they replaced, or None if it was inherited
+            while hasattr(func, '_debug_replaced'):
+                func = func._debug_replaced
+                func = getattr(func, '__func__', getattr(func, 'func', func))
+            code = getattr(func, '__code__', None)
+            if code is None:
+                continue
+            if full_name[1] == 'modules':
+                module = full_name[2]
+            elif full_name[1] in ('ir', 'res'):
+                module = full_name[1]
+            else:
+                module = ''
+            frames.append({
+                    'module': module,
+                    'base_name': full_name[-1],
+                    'path': '.'.join(full_name[:-1]),
+                    'super': int('super' in code.co_names),
+                    'code': (code.co_filename, code.co_firstlineno,
+                        code.co_name),
+                    })
+        return frames
+
+    @classmethod
+    def override_costs(cls, model_class, method_name, stats):
+        '''
+            Splits the timings of method_name (the stats of an
+            OverrideProfiler) among the overrides of the method. The time of
+            a layer is its cumulative time, minus the cumulative time of the
+            next layer if it calls super
+        '''
+        frames = cls.extract_override_frames(model_class, method_name)
+        for frame in frames:
+            calls, cumulative = stats.get(frame.pop('code'), (0, 0.0))
+            frame.update({
+                    'calls': calls,
+                    'cumulative': cumulative,
+                    })
+        for frame, next_frame in zip(frames, frames[1:] + [None]):
+            frame['layer_time'] = frame['cumulative']
+            if next_frame and frame['super']:
+                frame['layer_time'] = max(0.0,
+                    frame['layer_time'] - next_frame['cumulative'])
+        return frames
+
+    @classmethod
+    def get_override_profiler(cls, model_class, method_name):
+        return OverrideProfiler(model_class, [x['code'] for x in
+                cls.extract_override_frames(model_class, method_name)])
+
+    @classmethod
+    def add_override_profile(cls, model_class, method_name, profiler,
+            duration):
+        key = (model_class.__name__, method_name)
+        with cls._override_stats_lock:
+            if key in cls._override_stats:
+                cls._override_stats[key]['profiler'].add(profiler)
+                cls._override_stats[key]['calls'] += 1
+                cls._override_stats[key]['duration'] += duration
+            else:
+                aggregated = OverrideProfiler(model_class, profiler.codes)
+                aggregated.add(profiler)
+                cls._override_stats[key] = {
+                    'model_class': model_class,
+                    'profiler': aggregated,
+                    'calls': 1,
+                    'duration': duration,
+                    }
+        return cls.override_costs(model_class, method_name, profiler.stats)
+
+    @classmethod
+    def format_override_costs(cls, frames):
+        return ['%-30s %8.3fs %8.3fs %6i %s' % (x['module'] or '-',
+                x['layer_time'], x['cumulative'], x['calls'],
+                x['path'] + '.' + x['base_name']) for x in frames]
+
+    @classmethod
+    def raw_override_costs(cls, model_name=None, method_name=None):
+        '''
+            Returns the aggregated override costs of the methods profiled by
+            the "override_profile" configuration in the current process
+        '''
+        result = {}
+        with cls._override_stats_lock:
+            for (model, method), data in cls._override_stats.items():
+                if model_name not in (None, model):
+                    continue
+                if method_name not in (None, method):
+                    continue
+                result['%s:%s' % (model, method)] = {
+                    'calls': data['calls'],
+                    'duration': data['duration'],
+                    'layers': cls.override_costs(data['model_class'], method,
+                        data['profiler'].stats),
+                    }
+        return result
+
+    @classmethod
+    def get_override_codes(cls, model_class, method_name, module=None):
+        '''
+            Returns the code keys (filename, first line, name) of the
+            overrides of method_name, restricted to the ones of module if set
+        '''
+        codes = []
+        for frame in cls.extract_override_frames(model_class, method_name):
+            if module is None or frame['module'] == module:
+                codes.append(frame['code'])
+        return codes
+
+    @classmethod
+    def add_line_profile(cls, model_class, method_name, profiler, duration):
+        key = (model_class.__name__, method_name)
+        with cls._override_stats_lock:
+            if key in cls._line_stats:
+                cls._line_stats[key]['profiler'].add(profiler)
+                cls._line_stats[key]['calls'] += 1
+                cls._line_stats[key]['duration'] += duration
+            else:
+                cls._line_stats[key] = {
+                    'profiler': profiler,
+                    'calls': 1,
+                    'duration': duration,
+                    }
+
+    @classmethod
+    def raw_line_profiles(cls, model_name=None, method_name=None):
+        '''
+            Returns the aggregated line by line timings of the methods
+            profiled by the "line_profile" configuration in the current
+            process, as annotated source lines per override
+        '''
+        result = {}
+        with cls._override_stats_lock:
+            for (model, method), data in cls._line_stats.items():
+                if model_name not in (None, model):
+                    continue
+                if method_name not in (None, method):
+                    continue
+                result['%s:%s' % (model, method)] = {
+                    'calls': data['calls'],
+                    'duration': data['duration'],
+                    'sources': [LineProfiler.format_code(key, lines)
+                        for key, lines in data['profiler'].stats.items()],
+                    }
+        return result
+
+    @classmethod
+    def raw_startup_costs(cls, entries=None):
+        '''
+            Returns the pool initialization costs per module and per model
+            recorded when the "startup_costs" configuration is set
+        '''
+        return StartupCosts.report(entries)
+
+    @classmethod
+    def add_read_cost(cls, model_name, field_name, duration, queries):
+        database = Transaction().database.name
+        with cls._read_costs_lock:
+            cls._read_costs[database][(model_name, field_name)] = (
+                duration, queries)
+
+    @classmethod
+    def get_read_costs(cls, model_name=None):
+        '''
+            Returns the (duration, number of queries) of the last read of
+            each field of model_name (or of all models) in developer views,
+            for the current database, per model and field name
+        '''
+        database = Transaction().database.name
+        with cls._read_costs_lock:
+            costs = dict(cls._read_costs.get(database, {}))
+        result = defaultdict(dict)
+        for (model, fname), cost in costs.items():
+            if model_name in (None, model):
+                result[model][fname] = cost
+        return result
+
+    @classmethod
+    def raw_read_costs(cls, model_name=None):
+        '''
+            Returns the duration and number of queries of the last read of
+            each field in developer views, for the current database, when the
+            "debug_views_costs" configuration is set
+        '''
+        return {model: {fname: {
+                        'duration': duration,
+                        'queries': queries,
+                        } for fname, (duration, queries) in costs.items()}
+            for model, costs in cls.get_read_costs(model_name).items()}
+
+    @classmethod
+    def raw_cache_stats(cls):
+        '''
+            Returns the hits, misses, evictions and invalidations of the
+            in-process caches, recorded when the "cache_stats" configuration
+            is set
+        '''
+        return CacheStats.report()
+
+    @classmethod
+    def raw_metrics(cls):
+        '''
+            Returns the call counts and latencies of the methods configured
+            with the "metrics" configuration, in Prometheus text format
+        '''
+        return Metrics.render()
+
+    @classmethod
+    def raw_search_stats(cls, model_name=None):
+        '''
+            Returns the searches recorded when the "search_stats"
+            configuration is set, grouped by model, normalized domain and
+            order, most time consuming first
+        '''
+        return [{k: v for k, v in x.items() if k != 'sample'}
+            for x in SearchStats.report(model_name)]
+
+    @classmethod
+    def advise_indexes(cls, models=None, min_count=None):
+        '''
+            Explains the slowest query of each group of recorded searches, in
+            a savepoint which is rolled back, and returns per model the
+            explained searches, the indexed columns and, per filtered field,
+            the search count and time. An index is suggested for the fields
+            filtered at least min_count times by queries reading the whole
+            table, whose column is not the first column of an index.
+        '''
+        pool = Pool()
+        if min_count is None:
+            min_count = config.getint('debug', 'search_stats_min_count',
+                default=10)
+        searches = defaultdict(list)
+        for search in SearchStats.report():
+            if models is None or search['model'] in models:
+                searches[search['model']].append(search)
+        result = {}
+        cursor = Transaction().connection.cursor()
+        for model_name in (searches if models is None else models):
+            try:
+                Model = pool.get(model_name)
+            except KeyError:
+                continue
+            if (not issubclass(Model, ModelSQL)
+                    or callable(Model.table_query)):
+                continue
+            result[model_name] = cls.advise_model_indexes(Model,
+                searches[model_name], cursor, min_count)
+        return result
+
+    @classmethod
+    def advise_model_indexes(cls, Model, searches, cursor, min_count):
+        indexed = SearchStats.indexed_columns(cursor, Model._table)
+        # The primary key is not listed as an index by SQLite
+        indexed.add('id')
+        result = {
+            'indexed': sorted(indexed),
+            'searches': [],
+            'fields': {},
+            }
+        for search in searches:
+            # A savepoint rather than a new transaction, which would not see
+            # the uncommitted data, and would share the connection of the
+            # current one with in-memory SQLite databases
+            cursor.execute('SAVEPOINT debug_explain')
+            try:
+                query = Model.search(search['sample'],
+                    order=[tuple(x) for x in search['order']] or None,
+                    query=True)
+                plan = SearchStats.explain(cursor, query)
+                full_scan = SearchStats.full_scan(plan, query, Model._table)
+            except Exception:
+                logger.debug('Could not explain %s' % search['domain'],
+                    exc_info=True)
+                plan, full_scan = [], False
+            finally:
+                cursor.execute('ROLLBACK TO SAVEPOINT debug_explain')
+                cursor.execute('RELEASE SAVEPOINT debug_explain')
+            result['searches'].append({
+                    'domain': search['domain'],
+                    'order': search['order'],
+                    'count': search['count'],
+                    'duration': search['duration'],
+                    'plan': plan,
+                    'full_scan': full_scan,
+                    })
+            for fname, operator in set(search['fields']):
+                field = Model._fields.get(fname)
+                if field is None or isinstance(field, (fields.Function,
+                            fields.One2Many, fields.Many2Many)):
+                    continue
+                data = result['fields'].setdefault(fname, {
+                        'count': 0,
+                        'duration': 0,
+                        'full_scans': 0,
+                        'indexed': fname in indexed,
+                        })
+                data['count'] += search['count']
+                data['duration'] += search['duration']
+                if full_scan and operator in INDEXABLE_OPERATORS:
+                    data['full_scans'] += search['count']
+        for data in result['fields'].values():
+            data['suggested'] = (not data['indexed']
+                and data['full_scans'] >= min_count)
+        return result
+
     @classmethod
     def extract_views(cls, model_class, model_name, model_data_cache):
         pool = Pool()
@@ -446,7 +1183,8 @@ class ModelInfo(ModelView):
                     'priority': view.priority or '',
                     'field_childs': view.field_childs or '',
                     'name': view.name or '',
-                    'functional_id': model_data_cache[(view.module, view.id)],
+                    'functional_id': model_data_cache.get(
+                        (view.module, view.id), view.name or ''),
                     'inherit': [],
                     }
             for child in children:
@@ -455,8 +1193,8 @@ class ModelInfo(ModelView):
                         'type': child.type or '',
                         'priority': child.priority or '',
                         'field_childs': child.field_childs or '',
-                        'functional_id': model_data_cache[
-                            (child.module, child.id)],
+                        'functional_id': model_data_cache.get(
+                            (child.module, child.id), child.name or ''),
                         'name': child.name or master_views[view_id]['name'],
                         })
 
@@ -502,6 +1240,55 @@ class ModelInfo(ModelView):
                 }
         return infos
 
+    @classmethod
+    def raw_memory_infos(cls, models=None):
+        '''
+            Returns the approximate memory (in bytes) held by the pool classes
+            and by the in-process caches. Objects shared between models are
+            counted for each of them.
+        '''
+        pool = Pool()
+        caches = [x for x in Cache._instances.values()
+            if hasattr(x, '_database_cache')]
+        view_caches = [ModelView._fields_view_get_cache,
+            ModelView._view_toolbar_get_cache]
+
+        views = defaultdict(lambda: {'entries': 0, 'size': 0})
+        for cache in view_caches:
+            for lru in list(cache._database_cache.values()):
+                for key, value in list(lru.items()):
+                    model_key = key[0] if cache.context else key
+                    model_name = (model_key[0] if isinstance(model_key, tuple)
+                        else model_key)
+                    views[model_name]['entries'] += 1
+                    views[model_name]['size'] += deep_sizeof((key, value))
+
+        infos = {'models': {}, 'caches': {}}
+        for model_name, Model in pool.iterobject():
+            if models is not None and model_name not in models:
+                continue
+            data = {
+                'fields': deep_sizeof(getattr(Model, '_fields', {})),
+                '__rpc__': deep_sizeof(getattr(Model, '__rpc__', {})),
+                '_buttons': deep_sizeof(getattr(Model, '_buttons', {})),
+                'views': views[model_name]['size'],
+                'view_entries': views[model_name]['entries'],
+                'nb_fields': len(getattr(Model, '_fields', {})),
+                }
+            data['total'] = (data['fields'] + data['__rpc__'] +
+                data['_buttons'] + data['views'])
+            infos['models'][model_name] = data
+
+        for cache in caches:
+            lrus = list(cache._database_cache.values()) + list(
+                cache._transaction_cache.values())
+            infos['caches'][cache._name] = {
+                'entries': sum(len(x) for x in lrus),
+                'size_limit': cache.size_limit,
+                'size': sum(deep_sizeof(x) for x in lrus),
+                }
+        return infos
+
     @classmethod
     def raw_module_infos(cls):
         infos = {}
@@ -513,6 +1300,44 @@ class ModelInfo(ModelView):
                 }
         return infos
 
+    @classmethod
+    def get_attribute_index(cls, model_name):
+        '''
+            Returns the sorted names of the fields and methods of the model,
+            and the target models of its relational fields
+        '''
+        Model = Pool().get(model_name)
+        key = cls.get_attribute_index_key(Model)
+        index = cls._attribute_index_cache.get(key)
+        if index is not None:
+            return index
+        targets = {}
+        for fname, field in Model._fields.items():
+            target = cls.get_target_model(field)
+            if target:
+                targets[fname] = target
+        names = set(Model._fields)
+        for name in dir(Model):
+            if name.startswith('__'):
+                continue
+            if callable(getattr(Model, name, None)):
+                names.add(name)
+        index = {
+            'names': sorted(names),
+            'targets': targets,
+            }
+        cls._attribute_index_cache.set(key, index)
+        return index
+
+    @classmethod
+    def get_attribute_index_key(cls, Model):
+        '''
+            The pool classes are rebuilt with the classes of the activated
+            modules when the pool is initialized, so the index is cached per
+            model and modules of its classes
+        '''
+        return (Model.__name__, tuple(x.__module__ for x in Model.__mro__))
+
     @fields.depends('id_to_calculate', 'model_name', 'to_evaluate')
     def autocomplete_to_evaluate(self):
         if not self.id_to_calculate or not self.to_evaluate.strip():
@@ -526,13 +1351,17 @@ class ModelInfo(ModelView):
             base = base[:-1]
             if not base or base[0] != 'instance':
                 return [self.to_evaluate]
-            instance = Pool().get(self.model_name)(self.id_to_calculate)
-            value = eval('.'.join(base), {}, {'instance': instance})
-            if not isinstance(value, (ModelSQL, ModelView)):
-                return [self.to_evaluate]
-            return sorted(['.'.join(base + [k])
-                    for k in value.__class__._fields.keys()
-                    if k.startswith(target)] + [self.to_evaluate])
+            model_name = self.model_name
+            for name in base[1:]:
+                model_name = self.get_attribute_index(model_name)[
+                    'targets'][name]
+            names = self.get_attribute_index(model_name)['names']
+            matches = []
+            for name in names[bisect_left(names, target):]:
+                if not name.startswith(target):
+                    break
+                matches.append('.'.join(base + [name]))
+            return sorted(matches + [self.to_evaluate])
         except Exception:
             return [self.to_evaluate]
 
@@ -563,6 +1392,9 @@ class VisualizeDebug(ModelView):
 
     pyson = fields.Text('Pyson to Transform')
     synch_model_data = fields.Boolean('Synchronise Model Data')
+    check_pyson = fields.Boolean('Check All Pyson',
+        help='Encode and validate the PYSON of all models, and display the '
+        'errors and largest encoded PYSON')
     result = fields.Text('Result')
 
 
@@ -581,6 +1413,8 @@ class Debug(Wizard):
         # Run your code. return value will be wrote down in the display window
         if self.display.synch_model_data:
             return self.synch_model_data()
+        elif self.display.check_pyson:
+            return self.check_all_pyson()
         elif self.display.pyson:
             return self.transform_pyson()
 
@@ -589,15 +1423,52 @@ class Debug(Wizard):
         encoded = PYSONEncoder().encode(eval(self.display.pyson))
         return ''.join([x if x != '"' else '&quot;' for x in encoded])
 
+    def check_all_pyson(self, nb_largest=50):
+        infos = Pool().get('ir.model.debug.model_info').raw_pyson_infos()
+        lines = ['%(kind)s %(model)s %(name)s %(attribute)s: %(error)s' % x
+            for x in infos if x['error']]
+        lines = ['%i errors' % len(lines)] + lines + ['', 'Largest PYSON:']
+        lines += ['%(size)8i %(kind)s %(model)s %(name)s %(attribute)s' % x
+            for x in infos[:nb_largest] if not x['error']]
+        return '\n'.join(lines)
+
     def synch_model_data(self):
+        '''
+            Synchronises the model data by chunks, committing after each
+            chunk, so that an interrupted synchronisation is resumed by
+            running it again. Failing chunks are rollbacked and skipped :
+
+                [debug]
+                synch_model_data_batch_size=500
+        '''
         ModelData = Pool().get('ir.model.data')
-        to_sync = ModelData.search([('out_of_sync', '=', True)])
-        nb_to_sync = len(to_sync)
-        if to_sync:
-            ModelData.sync(to_sync)
-        to_sync = ModelData.search([('out_of_sync', '=', True)])
-        return 'Synchronised %s/%s model data' % (nb_to_sync - len(to_sync),
-            nb_to_sync)
+        transaction = Transaction()
+        batch_size = config.getint('debug', 'synch_model_data_batch_size',
+            default=500)
+        domain = [('out_of_sync', '=', True)]
+        nb_to_sync = ModelData.search_count(domain)
+        nb_done, errors, last_id = 0, [], 0
+        while True:
+            to_sync = ModelData.search(domain + [('id', '>', last_id)],
+                order=[('id', 'ASC')], limit=batch_size)
+            if not to_sync:
+                break
+            last_id = to_sync[-1].id
+            try:
+                ModelData.sync(to_sync)
+                transaction.commit()
+            except Exception as exc:
+                transaction.rollback()
+                errors.append('Could not synchronise model data %s to %s: '
+                    '%s' % (to_sync[0].id, last_id, str(exc)))
+                logger.warning(errors[-1])
+                continue
+            nb_done += len(to_sync)
+            logger.info('Synchronised model data chunk %s/%s' % (
+                    nb_done, nb_to_sync))
+        nb_remaining = ModelData.search_count(domain)
+        return '\n'.join(['Synchronised %s/%s model data' % (
+                    nb_to_sync - nb_remaining, nb_to_sync)] + errors)
 
     def transition_run(self):
         return 'display'
@@ -637,8 +1508,14 @@ class DebugModelInstance(ModelSQL, ModelView):
     def __setup__(cls):
         super(DebugModelInstance, cls).__setup__()
         cls._order.insert(0, ('name', 'ASC'))
-        cls.__rpc__.update({'refresh': RPC(readonly=False)})
-        cls._buttons.update({'open_initial': {}})
+        cls.__rpc__.update({
+                'refresh': RPC(readonly=False),
+                'analyse_on_change': RPC(),
+                })
+        cls._buttons.update({
+                'open_initial': {},
+                'analyse_searches': {},
+                })
 
     @classmethod
     def __register__(cls, module):
@@ -666,6 +1543,11 @@ class DebugModelInstance(ModelSQL, ModelView):
     def open_initial(cls, models):
         pass
 
+    @classmethod
+    @ModelView.button
+    def analyse_searches(cls, models):
+        cls.store_search_analysis([x.name for x in models])
+
     @classmethod
     def refresh(cls, name=None, models=None):
         cls._history = False
@@ -702,6 +1584,10 @@ class DebugModelInstance(ModelSQL, ModelView):
         # Finalize fields
         cls.finalize_fields(base_data)
         Model.save([x['__instance'] for x in base_data.values()])
+        cls.store_on_change_analysis(list(base_data.keys()))
+
+        # Build search indexes
+        Pool().get('debug.model.index').build(base_data)
 
     @classmethod
     def import_model(cls, model_name, data):
@@ -874,6 +1760,183 @@ class DebugModelInstance(ModelSQL, ModelView):
                     field.on_change_with_fields = on_change_with_fields
             model_instance.fields_ = list(model_instance.fields_)
 
+    @classmethod
+    def store_on_change_analysis(cls, models):
+        '''
+            Stores the on_change fan out and cycles of the fields of models
+        '''
+        Field = Pool().get('debug.model.field')
+        analysis = cls.analyse_on_change(models)
+        to_write = defaultdict(list)
+        for field in Field.search([('model.name', 'in', models)]):
+            model_analysis = analysis[field.model.name]
+            field_analysis = model_analysis['fields'].get(field.name, {})
+            to_write[(len(field_analysis.get('recomputed_fields', [])),
+                    any(field.name in x for x in model_analysis['cycles']))
+                ].append(field)
+        args = []
+        for (fan_out, cycle), debug_fields in to_write.items():
+            args += [debug_fields, {
+                    'on_change_fan_out': fan_out,
+                    'on_change_cycle': cycle,
+                    }]
+        if args:
+            Field.write(*args)
+
+    @classmethod
+    def store_search_analysis(cls, models):
+        '''
+            Stores the recorded searches and the index advice of the fields
+            of models. Nothing is done if the searches are not recorded, as
+            the advice explains their queries.
+        '''
+        if not config.getboolean('debug', 'search_stats', default=False):
+            return
+        pool = Pool()
+        Field = pool.get('debug.model.field')
+        advice = pool.get('ir.model.debug.model_info').advise_indexes(models)
+        to_write = defaultdict(list)
+        for field in Field.search([('model.name', 'in', models)]):
+            model_advice = advice.get(field.model.name, {})
+            field_advice = model_advice.get('fields', {}).get(field.name, {})
+            to_write[(field_advice.get('count', 0),
+                    field_advice.get('duration', 0),
+                    field.name in model_advice.get('indexed', []),
+                    field_advice.get('suggested', False))].append(field)
+        args = []
+        for (count, duration, indexed, suggested), debug_fields in \
+                to_write.items():
+            args += [debug_fields, {
+                    'search_calls': count,
+                    'search_time': duration,
+                    'indexed': indexed,
+                    'suggested_index': suggested,
+                    }]
+        if args:
+            Field.write(*args)
+
+    @classmethod
+    def analyse_on_change(cls, models=None):
+        '''
+            Analyses the on_change / on_change_with depends of the fields.
+
+            For each field, returns the fields which are (transitively)
+            recomputed through on_change_with methods when it changes, and
+            the methods which are called. Also returns the depends cycles,
+            and the methods whose depends are larger than the threshold :
+
+                [debug]
+                on_change_depends_threshold=20
+        '''
+        pool = Pool()
+        Field = pool.get('debug.model.field')
+        OnChange = pool.get('debug.model.field.on_change')
+        OnChangeWith = pool.get('debug.model.field.on_change_with')
+        threshold = config.getint('debug', 'on_change_depends_threshold',
+            default=20)
+
+        field_domain, relation_domain = [], []
+        if models is not None:
+            field_domain = [('model.name', 'in', models)]
+            relation_domain = [('from_field.model.name', 'in', models)]
+        all_fields = {x.id: x for x in Field.search(field_domain)}
+
+        # Field -> fields whose on_change_with depends on it
+        graph = defaultdict(set)
+        depends = defaultdict(int)
+        for relation in OnChangeWith.search(relation_domain):
+            graph[relation.to_field.id].add(relation.from_field.id)
+            depends[relation.from_field.on_change_with_method] += 1
+        for relation in OnChange.search(relation_domain):
+            depends[relation.from_field.on_change_method] += 1
+
+        result = {}
+        for field in all_fields.values():
+            result.setdefault(field.model.name, {
+                    'fields': {},
+                    'cycles': [],
+                    'large_depends': {},
+                    })
+        for method, nb_depends in depends.items():
+            if method and nb_depends > threshold:
+                result[method.model.name]['large_depends'][method.name] = \
+                    nb_depends
+
+        for field in all_fields.values():
+            recomputed, to_visit = set(), list(graph[field.id])
+            while to_visit:
+                cur_id = to_visit.pop()
+                if cur_id in recomputed:
+                    continue
+                recomputed.add(cur_id)
+                to_visit.extend(graph[cur_id])
+            methods = [all_fields[x].on_change_with_method.name
+                for x in recomputed
+                if all_fields[x].on_change_with_method]
+            if field.on_change_method:
+                methods.append(field.on_change_method.name)
+            if not recomputed and not methods:
+                continue
+            result[field.model.name]['fields'][field.name] = {
+                'recomputed_fields': sorted(
+                    all_fields[x].name for x in recomputed),
+                'methods': sorted(methods),
+                }
+
+        for cycle in cls._strongly_connected(graph):
+            names = sorted(all_fields[x].name for x in cycle)
+            result[all_fields[cycle[0]].model.name]['cycles'].append(names)
+        return result
+
+    @classmethod
+    def _strongly_connected(cls, graph):
+        '''
+            Returns the cycles (strongly connected components with more than
+            one node, or with a self loop) of the graph
+        '''
+        index, lowlinks, stack, on_stack, cycles = {}, {}, [], set(), []
+
+        # Iterative form of Tarjan's algorithm, the on_change depends chains
+        # may be longer than the recursion limit. Each item of to_visit is a
+        # node and the iterator of its remaining targets.
+        for root in list(graph):
+            if root in index:
+                continue
+            index[root] = lowlinks[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            to_visit = [(root, iter(graph.get(root, ())))]
+            while to_visit:
+                node, targets = to_visit[-1]
+                for target in targets:
+                    if target not in index:
+                        index[target] = lowlinks[target] = len(index)
+                        stack.append(target)
+                        on_stack.add(target)
+                        to_visit.append(
+                            (target, iter(graph.get(target, ()))))
+                        break
+                    elif target in on_stack:
+                        lowlinks[node] = min(lowlinks[node], index[target])
+                else:
+                    to_visit.pop()
+                    if to_visit:
+                        parent = to_visit[-1][0]
+                        lowlinks[parent] = min(lowlinks[parent],
+                            lowlinks[node])
+                    if lowlinks[node] != index[node]:
+                        continue
+                    component = []
+                    while True:
+                        target = stack.pop()
+                        on_stack.discard(target)
+                        component.append(target)
+                        if target == node:
+                            break
+                    if len(component) > 1 or node in graph.get(node, ()):
+                        cycles.append(component)
+        return cycles
+
 
 class DebugMROInstance(ModelSQL, ModelView):
     'Model MRO for debug'
@@ -953,6 +2016,21 @@ class DebugFieldInstance(ModelSQL, ModelView):
     on_change_with_fields = fields.Many2Many(
         'debug.model.field.on_change_with', 'from_field', 'to_field',
         'On Change With Fields', readonly=True)
+    on_change_fan_out = fields.Integer('On Change Fan Out', readonly=True,
+        help='Number of fields recomputed (through on_change_with methods) '
+        'when this field is modified')
+    on_change_cycle = fields.Boolean('In On Change Cycle', readonly=True,
+        help='This field is part of a cycle of on_change_with depends')
+    search_calls = fields.Integer('Search Count', readonly=True,
+        help='Number of recorded searches filtering on this field')
+    search_time = fields.Float('Search Time (s)', readonly=True,
+        help='Cumulated time of the recorded searches filtering on this '
+        'field')
+    indexed = fields.Boolean('Indexed', readonly=True,
+        help='The column is the first column of an index')
+    suggested_index = fields.Boolean('Suggested Index', readonly=True,
+        help='The field is frequently filtered by queries reading the '
+        'whole table, and is not indexed')
 
     @classmethod
     def __setup__(cls):
@@ -1078,6 +2156,84 @@ class DebugOnChangeWithRelation(ModelSQL, ModelView):
         required=True, select=True, ondelete='CASCADE')
 
 
+class DebugIndexInstance(ModelSQL, ModelView):
+    'Index for debug'
+
+    __name__ = 'debug.model.index'
+
+    kind = fields.Selection([('method', 'Method'), ('field', 'Field'),
+            ('target', 'Target Model')], 'Kind', readonly=True)
+    key = fields.Char('Key', readonly=True)
+    model = fields.Char('Model', select=True, readonly=True)
+    name = fields.Char('Name', readonly=True)
+    module = fields.Char('Module', readonly=True)
+    override = fields.Boolean('Override', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(DebugIndexInstance, cls).__setup__()
+        cls.__rpc__.update({'lookup': RPC()})
+
+    @classmethod
+    def __register__(cls, module):
+        super(DebugIndexInstance, cls).__register__(module)
+        table = cls.__table_handler__(module)
+        table.index_action(['kind', 'key'], 'add')
+        table.index_action(['kind', 'module'], 'add')
+
+    @classmethod
+    def build(cls, full_data):
+        '''
+            Builds the denormalised indexes from the raw field infos :
+                - method : method name -> (model, module) of each frame
+                - field : module -> fields declared in the module
+                - target : target model -> relational fields
+        '''
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        for sub_models in grouped_slice(list(full_data.keys())):
+            cursor.execute(*table.delete(
+                    where=table.model.in_(list(sub_models))))
+
+        values = []
+        for model_name, data in full_data.items():
+            for method_name, method_data in data['methods'].items():
+                for frame in method_data['mro'].values():
+                    values.append(['method', method_name, model_name,
+                            method_name, frame['module'],
+                            bool(frame['override'])])
+            for field_name, field_data in data['fields'].items():
+                values.append(['field', field_data['module'], model_name,
+                        field_name, field_data['module'], False])
+                if field_data.get('target_model'):
+                    values.append(['target', field_data['target_model'],
+                            model_name, field_name, field_data['module'],
+                            False])
+        columns = [table.kind, table.key, table.model, table.name,
+            table.module, table.override, table.create_uid,
+            table.create_date]
+        for sub_values in grouped_slice(values, 1000):
+            cursor.execute(*table.insert(columns,
+                    [x + [0, CurrentTimestamp()] for x in sub_values]))
+
+    @classmethod
+    def lookup(cls, kind, key=None, module=None, model=None,
+            override=None):
+        '''
+            Queries the indexes, for instance the models overriding "write"
+            in module "party" :
+
+                lookup('method', key='write', module='party', override=True)
+        '''
+        domain = [('kind', '=', kind)]
+        for fname, value in [('key', key), ('module', module),
+                ('model', model), ('override', override)]:
+            if value is not None:
+                domain.append((fname, '=', value))
+        return cls.search_read(domain, order=[('model', 'ASC')],
+            fields_names=['key', 'model', 'name', 'module', 'override'])
+
+
 class RefreshDebugData(Wizard):
     'Refresh Debug Data'
 
@@ -73,6 +73,10 @@ setup(name=name,
         'trytond.modules.debug': (info.get('xml', [])
             + ['tryton.cfg', 'view/*.xml', 'locale/*.po']),
         },
+    scripts=[
+        'bin/trytond-debug-replay',
+        'bin/trytond-debug-survey',
+        ],
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Environment :: Plugins',
@@ -0,0 +1,301 @@
+# This file is part of Coog. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+'''
+    Benchmarks of the debug module's own hot paths, on a synthetic pool of
+    models with deep override chains, many Function fields and views, on a
+    SQLite database :
+
+        python -m trytond.modules.debug.tests.benchmark_debug \\
+            --save-baseline baseline.json
+        python -m trytond.modules.debug.tests.benchmark_debug \\
+            --baseline baseline.json --threshold 0.2
+
+    The run fails (exit code 1) if a benchmark's median is slower than the
+    baseline by more than the threshold. The synthetic models are registered
+    in the debug module by the benchmark only.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+os.environ.setdefault('DB_NAME', ':memory:')
+
+BENCHMARK_MODULE = 'debug'
+MODEL_PREFIX = 'debug.benchmark.model'
+
+LAYER_TEMPLATE = '''
+class Layer(%(bases)s):
+    'Benchmark Model %(index)s'
+    __name__ = '%(name)s'
+    char_%(layer)s = fields.Char('Char %(layer)s')
+    integer_%(layer)s = fields.Integer('Integer %(layer)s')
+    %(functions)s
+    %(relations)s
+
+    @classmethod
+    def read(cls, ids, fields_names):
+        return super(Layer, cls).read(ids, fields_names)
+
+    @classmethod
+    def search(cls, domain, offset=0, limit=None, order=None, count=False,
+            query=False):
+        return super(Layer, cls).search(domain, offset, limit, order, count,
+            query)
+
+    @classmethod
+    def create(cls, vlist):
+        return super(Layer, cls).create(vlist)
+
+    @classmethod
+    def get_function(cls, records, names):
+        result = %(getter_super)s
+        for name in names:
+            result.setdefault(name, {})
+            for record in records:
+                result[name][record.id] = '%%s %(layer)s' %% record.id
+        return result
+
+    @fields.depends('char_%(layer)s')
+    def on_change_with_integer_%(layer)s(self, name=None):
+        return len(self.char_%(layer)s or '')
+'''
+
+
+def build_models(nb_models, depth, nb_functions):
+    '''
+        Returns the classes of nb_models models, each made of depth layers
+        (the initial class and its overrides), with nb_functions Function
+        fields per layer, a Many2One to the previous model and the matching
+        One2Many
+    '''
+    from trytond.model import ModelSQL, ModelView, fields
+    from trytond.pool import PoolMeta
+
+    classes = []
+    for index in range(nb_models):
+        name = '%s%03d' % (MODEL_PREFIX, index)
+        for layer in range(depth):
+            functions = '\n    '.join(
+                "function_%s_%s = fields.Function(fields.Char('Function "
+                "%s %s'), 'get_function')" % (layer, i, layer, i)
+                for i in range(nb_functions))
+            relations = ''
+            if layer == 0 and index:
+                relations = ("parent = fields.Many2One('%s%03d', 'Parent')"
+                    % (MODEL_PREFIX, index - 1))
+            if layer == 0 and index < nb_models - 1:
+                relations += ("\n    children = fields.One2Many('%s%03d', "
+                    "'parent', 'Children')" % (MODEL_PREFIX, index + 1))
+            namespace = {
+                'ModelSQL': ModelSQL,
+                'ModelView': ModelView,
+                'PoolMeta': PoolMeta,
+                'fields': fields,
+                }
+            exec(LAYER_TEMPLATE % {
+                    'bases': 'ModelSQL, ModelView' if not layer
+                    else 'metaclass=PoolMeta',
+                    'index': index,
+                    'name': name,
+                    'layer': layer,
+                    'functions': functions,
+                    'relations': relations,
+                    'getter_super': '{}' if not layer else
+                    'super(Layer, cls).get_function(records, names)',
+                    }, namespace)
+            classes.append(namespace['Layer'])
+    return classes
+
+
+def create_views(model_names, depth, with_functions=True):
+    '''
+        Creates a tree view, and a form view with depth - 1 inheriting views
+        for each model
+    '''
+    from trytond.pool import Pool
+    View = Pool().get('ir.ui.view')
+    to_create = []
+    for name in model_names:
+        to_create.append({
+                'model': name,
+                'type': 'tree',
+                'data': '<tree><field name="char_0"/>'
+                '<field name="integer_0"/></tree>',
+                })
+        to_create.append({
+                'model': name,
+                'type': 'form',
+                'data': '<form><label name="char_0"/><field name="char_0"/>'
+                '</form>',
+                })
+    views = View.create(to_create)
+    inherits = []
+    for view in views[1::2]:
+        for layer in range(1, depth):
+            inherits.append({
+                    'model': view.model,
+                    'inherit': view.id,
+                    'data': '<data><xpath expr="/form" position="inside">'
+                    '<label name="char_%s"/><field name="char_%s"/>%s'
+                    '</xpath></data>' % (layer, layer,
+                        '<label name="function_%s_0"/>'
+                        '<field name="function_%s_0"/>' % (layer, layer)
+                        if with_functions else ''),
+                    })
+    if inherits:
+        View.create(inherits)
+
+
+def measure(function, repeat):
+    '''
+        Returns the durations (in seconds) of repeat calls of function
+    '''
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def report(results, baseline=None, threshold=0.2):
+    '''
+        Prints the results ({name: durations}) and returns the names of the
+        benchmarks slower than the baseline ({name: median}) by more than
+        threshold
+    '''
+    regressions = []
+    print('%-40s %10s %10s %10s %8s' % ('benchmark', 'min (ms)',
+            'median (ms)', 'baseline', 'delta'))
+    for name, durations in results.items():
+        median = statistics.median(durations)
+        reference = (baseline or {}).get(name)
+        delta = ''
+        if reference:
+            ratio = median / reference - 1
+            delta = '%+.1f%%' % (ratio * 100)
+            if ratio > threshold:
+                regressions.append(name)
+                delta += ' !'
+        print('%-40s %10.1f %10.1f %10s %8s' % (name, min(durations) * 1000,
+                median * 1000,
+                '%.1f' % (reference * 1000) if reference else '-', delta))
+    return regressions
+
+
+def run_benchmarks(model_names, repeat):
+    from trytond.config import config
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+    from trytond.modules import debug
+
+    pool = Pool()
+    ModelInfo = pool.get('ir.model.debug.model_info')
+    DebugModelInstance = pool.get('debug.model')
+    classes = [pool.get(x) for x in model_names]
+    model_data = pool.get('ir.model.data').search([
+            ('model', '=', 'ir.ui.view')])
+    model_data_cache = {(x.module, x.db_id): x.fs_id for x in model_data}
+    results = {}
+
+    results['raw_field_infos'] = measure(
+        lambda: ModelInfo.raw_field_infos(model_names), repeat)
+    results['extract_mro'] = measure(
+        lambda: [ModelInfo.extract_mro(x, x.__name__) for x in classes],
+        repeat)
+    results['extract_views'] = measure(
+        lambda: [ModelInfo.extract_views(x, x.__name__, model_data_cache)
+            for x in classes], repeat)
+
+    # The debug data of all models was committed during the setup, the
+    # refreshes are rolled back to start from the same state
+    def refresh(models):
+        try:
+            DebugModelInstance.refresh(models=models)
+        finally:
+            Transaction().rollback()
+    results['refresh'] = measure(lambda: refresh(model_names), repeat)
+    results['refresh_all'] = measure(lambda: refresh(None), repeat)
+    results['detect_api_changes'] = measure(
+        lambda: debug.detect_api_changes(pool), repeat)
+
+    # The patchers modify the pool classes, so they can only run once
+    config.has_section('debug') or config.add_section('debug')
+    config.set('debug', 'methods', 'read,search,create,write,delete')
+    config.set('debug', 'fields_methods', 'get')
+    config.set('debug', 'debug_views', 'True')
+    results['set_method_names_for_profiling'] = measure(
+        lambda: debug.set_method_names_for_profiling(pool, False), 1)
+    results['name_one2many_gets'] = measure(
+        lambda: debug.name_one2many_gets(pool, False), 1)
+    results['enable_debug_views'] = measure(
+        lambda: debug.enable_debug_views(pool, False), 1)
+
+    def developer_views():
+        with Transaction().set_context(developper_view=True):
+            for klass in classes:
+                klass.fields_view_get(view_type='form')
+                klass.fields_view_get(view_type='tree')
+    results['developer_views'] = measure(developer_views, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the debug module on a synthetic pool')
+    parser.add_argument('--models', type=int, default=200,
+        help='number of synthetic models')
+    parser.add_argument('--depth', type=int, default=8,
+        help='number of classes (initial and overrides) per model')
+    parser.add_argument('--functions', type=int, default=5,
+        help='number of Function fields per class')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', help='compare to this baseline file')
+    parser.add_argument('--save-baseline', dest='save_baseline',
+        help='save the medians to this baseline file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+        help='maximum slowdown ratio before failing')
+    options = parser.parse_args()
+
+    from trytond.tests.test_tryton import activate_module, DB_NAME
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    start = time.perf_counter()
+    Pool.register(*build_models(options.models, options.depth,
+            options.functions), module=BENCHMARK_MODULE, type_='model')
+    activate_module(BENCHMARK_MODULE)
+    model_names = ['%s%03d' % (MODEL_PREFIX, i)
+        for i in range(options.models)]
+    with Transaction().start(DB_NAME, 0) as transaction:
+        create_views(model_names, options.depth, bool(options.functions))
+        Pool().get('debug.model').refresh()
+        transaction.commit()
+    print('Synthetic pool of %i models built in %.1fs' % (options.models,
+            time.perf_counter() - start))
+
+    with Transaction().start(DB_NAME, 0) as transaction:
+        try:
+            results = run_benchmarks(model_names, options.repeat)
+        finally:
+            transaction.rollback()
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, options.threshold)
+    if options.save_baseline:
+        with open(options.save_baseline, 'w') as f:
+            json.dump({k: statistics.median(v) for k, v in results.items()},
+                f, indent=4, sort_keys=True)
+    if regressions:
+        print('Regressions: %s' % ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
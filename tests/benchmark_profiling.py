@@ -0,0 +1,130 @@
+# This file is part of Coog. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+'''
+    Measures the overhead of the profiling wrappers on ORM calls, on a SQLite
+    database :
+
+        python -m trytond.modules.debug.tests.benchmark_profiling
+
+    The wrappers are enabled one after the other, so each stage includes the
+    wrappers of the previous ones :
+
+        - baseline : no wrappers
+        - method_names : set_method_names_for_profiling on read, search and
+          create
+        - field_getters : name_one2many_gets on the fields "get" method
+        - auto_profile : activate_auto_profile on read, search and create of
+          the benchmarked model (with a threshold high enough to log nothing)
+'''
+import os
+import time
+import argparse
+
+os.environ.setdefault('DB_NAME', ':memory:')
+
+from .benchmark_debug import (BENCHMARK_MODULE, MODEL_PREFIX,  # NOQA
+    build_models)
+
+METHODS = 'read,search,create'
+
+
+def run_workloads(Model, ids, iterations, repeat):
+    '''
+        Returns the duration per call (in seconds) of each workload, the best
+        of repeat rounds of iterations calls
+    '''
+    from trytond.transaction import Transaction
+
+    fields_names = list(Model._fields.keys())
+    workloads = {
+        'read': lambda: Model.read(ids, fields_names),
+        'search': lambda: Model.search([]),
+        'create': lambda: Model.create([{'char_0': 'x'}]),
+        }
+    results = {}
+    for name, workload in workloads.items():
+        # Warm up the caches
+        workload()
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                workload()
+            durations.append((time.perf_counter() - start) / iterations)
+            Transaction().rollback()
+        results[name] = min(durations)
+    return results
+
+
+def enable_stage(stage, pool, model_name):
+    from trytond.config import config
+    from trytond.modules import debug
+
+    config.has_section('debug') or config.add_section('debug')
+    if stage == 'method_names':
+        config.set('debug', 'methods', METHODS)
+        debug.set_method_names_for_profiling(pool, False)
+    elif stage == 'field_getters':
+        config.set('debug', 'fields_methods', 'get')
+        debug.name_one2many_gets(pool, False)
+    elif stage == 'auto_profile':
+        config.set('debug', 'auto_profile_threshold', '3600')
+        config.has_section('auto_profile') or config.add_section(
+            'auto_profile')
+        config.set('auto_profile', 'benchmark', '%s:%s' % (model_name,
+                METHODS))
+        debug.activate_auto_profile(pool, False)
+
+
+def report(results):
+    baseline = results['baseline']
+    print('%-15s %-8s %12s %12s %14s %10s' % ('stage', 'call', 'ns/call',
+            'calls/s', 'overhead (ns)', 'overhead'))
+    for stage, durations in results.items():
+        for name, duration in durations.items():
+            overhead = duration - baseline[name]
+            print('%-15s %-8s %12.0f %12.1f %14.0f %9.1f%%' % (stage, name,
+                    duration * 1e9, 1 / duration, overhead * 1e9,
+                    overhead / baseline[name] * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the overhead of the profiling wrappers')
+    parser.add_argument('--records', type=int, default=100,
+        help='number of records read by each call')
+    parser.add_argument('--depth', type=int, default=4,
+        help='number of classes (initial and overrides) of the model')
+    parser.add_argument('--functions', type=int, default=5,
+        help='number of Function fields per class')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    from trytond.tests.test_tryton import activate_module, DB_NAME
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    Pool.register(*build_models(1, options.depth, options.functions),
+        module=BENCHMARK_MODULE, type_='model')
+    activate_module(BENCHMARK_MODULE)
+    model_name = '%s000' % MODEL_PREFIX
+
+    with Transaction().start(DB_NAME, 0) as transaction:
+        pool = Pool()
+        Model = pool.get(model_name)
+        ids = [x.id for x in Model.create(
+                [{'char_0': str(i)} for i in range(options.records)])]
+        transaction.commit()
+
+        results = {}
+        for stage in ('baseline', 'method_names', 'field_getters',
+                'auto_profile'):
+            enable_stage(stage, pool, model_name)
+            results[stage] = run_workloads(pool.get(model_name), ids,
+                options.iterations, options.repeat)
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,1152 @@
 # This file is part of Coog. The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
-from trytond.tests.test_tryton import ModuleTestCase
+import os
+import sys
+import json
+import time
+import pstats
+import shutil
+import logging
+import cProfile
+import tempfile
+import tracemalloc
+
+from trytond.tests.test_tryton import (ModuleTestCase, with_transaction,
+    DB_NAME, USER)
+from trytond.cache import MemoryCache
+from trytond.config import config
+from trytond.model import ModelView, ModelSQL
+from trytond.pool import Pool
+from trytond.transaction import Transaction
+
+from trytond.modules.debug import (activate_memory_profile,
+    enable_debug_views, record_searches, instrument_caches,
+    profile_overrides, activate_tracing, collect_metrics)
+from trytond.modules.debug.benchmark import survey, format_survey
+from trytond.modules.debug.capture import (_compact, capture_call,
+    load_capture, replay_capture)
+from trytond.modules.debug.debug import ModelInfo, DebugModelInstance
+from trytond.modules.debug.tools import (QueryCounter, CacheStats,
+    StartupCosts, SearchStats, Tracer, Metrics, LineProfiler,
+    OverrideProfiler, deep_sizeof, profile_to_folded, flame_graph_svg)
+
+
+def _busy(duration):
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        pass
+
+
+def _inner():
+    _busy(0.02)
+
+
+def _outer():
+    _busy(0.01)
+    _inner()
+
+
+def _three_lines(value):
+    value += 1
+    value *= 2
+    return value
+
+
+class _Base(object):
+    def method(self, depth):
+        if depth:
+            return self.method(depth - 1)
+        return depth
+
+
+class _Sub(_Base):
+    pass
+
+
+def _code_key(function):
+    code = function.__code__
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class _Allocator(object):
+    @classmethod
+    def allocate(cls, size):
+        return [bytearray(1024) for _ in range(size)]
+
+
+class _FakePool(object):
+    def __init__(self, **models):
+        self.models = models
+
+    def get(self, name):
+        return self.models[name]
+
+
+class _CountedCache(MemoryCache):
+    'Cache class patched by the tests, to keep the other caches unchanged'
 
 
 class DebugTestCase(ModuleTestCase):
     'Test Debug module'
     module = 'debug'
 
+    def test_startup_costs(self):
+        'Test the report of the pool initialization costs'
+        for name in ('modules', 'models', 'model_modules'):
+            self.addCleanup(setattr, StartupCosts, name,
+                getattr(StartupCosts, name))
+        StartupCosts.modules = type(StartupCosts.modules)(
+            StartupCosts.modules.default_factory)
+        StartupCosts.models = type(StartupCosts.models)(
+            StartupCosts.models.default_factory)
+        StartupCosts.model_modules = {'res.user': 'res'}
+
+        StartupCosts.add('import', 0.01, module='ir')
+        StartupCosts.add('setup', 0.02, module='res', model='res.user')
+        StartupCosts.add('register_db', 0.03, module='res',
+            model='res.user')
+        StartupCosts.add('fill', 0.001, module='debug')
+        report = StartupCosts.report()
+        self.assertEqual([x['name'] for x in report['modules']],
+            ['res', 'ir', 'debug'])
+        self.assertAlmostEqual(report['modules'][0]['total'], 0.05)
+        self.assertEqual(report['modules'][0]['import'], 0.0)
+        user, = report['models']
+        self.assertEqual(user['module'], 'res')
+        self.assertAlmostEqual(user['register_db'], 0.03)
+        self.assertEqual(len(StartupCosts.report(1)['modules']), 1)
+
+        lines = StartupCosts.format_report(2)
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[0].split(),
+            ['modules', 'import', 'register', 'fill', 'setup',
+                'post_setup', 'register_db', 'total'])
+        self.assertTrue(lines[1].startswith('res '))
+        self.assertTrue(lines[1].endswith('50.0ms'))
+        self.assertTrue(lines[3].startswith('models '))
+
+    def test_deep_sizeof(self):
+        'Test the approximate size of nested objects'
+        value = 'x' * 10000
+        self.assertGreater(deep_sizeof([value]), 10000)
+        self.assertLess(deep_sizeof([value, value]),
+            deep_sizeof([value]) + sys.getsizeof(value))
+        self.assertGreater(deep_sizeof({'a': [value]}), 10000)
+        self.assertLess(deep_sizeof(_Base), 10000)
+
+    @with_transaction()
+    def test_raw_memory_infos(self):
+        'Test the memory usage of the pool classes and caches'
+        ModelInfo = Pool().get('ir.model.debug.model_info')
+        infos = ModelInfo.raw_memory_infos(models=['res.user'])
+        self.assertEqual(list(infos['models']), ['res.user'])
+        user = infos['models']['res.user']
+        self.assertGreater(user['nb_fields'], 0)
+        self.assertGreater(user['fields'], 0)
+        self.assertEqual(user['total'], user['fields'] + user['__rpc__']
+            + user['_buttons'] + user['views'])
+        self.assertTrue(infos['caches'])
+        for cache in infos['caches'].values():
+            self.assertEqual(set(cache), {'entries', 'size_limit', 'size'})
+
+    def test_search_stats_normalize(self):
+        'Test the normalization of the recorded domains'
+        domain = ['OR', ('name', '=', 'foo'),
+            [('party.name', 'ilike', '%bar%'), ('active', '=', True)]]
+        normalized = SearchStats.normalize(domain)
+        self.assertEqual(normalized, ('OR', ('name', '=', '?'),
+                (('party.name', 'ilike', '?'), ('active', '=', '?'))))
+        self.assertEqual(SearchStats.filtered_fields(normalized),
+            [('name', '='), ('party', 'ilike'), ('active', '=')])
+
+    def test_search_stats_record(self):
+        'Test the grouping of the searches by normalized domain'
+        SearchStats.reset()
+        try:
+            SearchStats.record('party.party', [('name', '=', 'a')],
+                [('name', 'ASC')], 0.1)
+            SearchStats.record('party.party', [('name', '=', 'b')],
+                [('name', 'ASC')], 0.3)
+            SearchStats.record('party.party', [('name', '=', 'c')], None,
+                0.2)
+            SearchStats.record('res.user', [], None, 0.05)
+            report = SearchStats.report('party.party')
+            self.assertEqual(len(report), 2)
+            ordered, unordered = report
+            self.assertEqual(ordered['count'], 2)
+            self.assertAlmostEqual(ordered['duration'], 0.4)
+            self.assertEqual(ordered['sample'], [('name', '=', 'b')])
+            self.assertEqual(ordered['order'], [['name', 'ASC']])
+            self.assertEqual(ordered['fields'], [('name', '=')])
+            self.assertEqual(unordered['count'], 1)
+            self.assertEqual(len(SearchStats.report()), 3)
+        finally:
+            SearchStats.reset()
+
+    def test_search_stats_max_entries(self):
+        'Test the bound of the number of recorded groups of searches'
+        max_entries = SearchStats.max_entries
+        SearchStats.reset()
+        try:
+            SearchStats.max_entries = 2
+            SearchStats.record('party.party', [('name', '=', 'a')], None, 1)
+            SearchStats.record('party.party', [('code', '=', 'a')], None, 1)
+            SearchStats.record('party.party', [('name', '=', 'b')], None, 1)
+            SearchStats.record('party.party', [('active', '=', True)], None,
+                1)
+            self.assertEqual(sorted(x['domain'] for x in SearchStats.report()),
+                ["(('active', '=', '?'),)", "(('name', '=', '?'),)"])
+        finally:
+            SearchStats.max_entries = max_entries
+            SearchStats.reset()
+
+    @with_transaction()
+    def test_search_stats_sample(self):
+        'Test the copy of the slowest domain of the recorded searches'
+        User = Pool().get('res.user')
+        admin, = User.search([('login', '=', 'admin')])
+        domain = [('create_uid', '=', admin), ('id', 'in', [admin.id])]
+        SearchStats.reset()
+        try:
+            SearchStats.record('res.user', domain, None, 1)
+            domain[1][2].append(0)
+            domain.append(('login', '=', 'foo'))
+            search, = SearchStats.report('res.user')
+            self.assertEqual(search['sample'],
+                [('create_uid', '=', admin.id), ('id', 'in', [admin.id])])
+        finally:
+            SearchStats.reset()
+
+    @with_transaction()
+    def test_advise_indexes(self):
+        'Test the index advice of the searches recorded by the hook'
+        pool = Pool()
+        User = pool.get('res.user')
+        Model = pool.get('debug.model')
+        Field = pool.get('debug.model.field')
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        Model.refresh()
+        SearchStats.reset()
+        self.addCleanup(SearchStats.reset)
+        self.restore_method(User, 'search')
+        self.set_config('debug', 'search_stats', 'True')
+        self.set_config('debug', 'search_stats_models', 'res.user')
+        self.set_config('debug', 'search_stats_min_count', '2')
+        record_searches(pool, False)
+
+        for email in ['a@example.com', 'b@example.com']:
+            User.search([('email', '=', email)])
+        User.search([('name', '=', 'Administrator')],
+            order=[('login', 'ASC')])
+        User.search([('email', '=', 'c@example.com')], query=True)
+        self.assertEqual(sorted((x['domain'], x['count'])
+                for x in ModelInfo.raw_search_stats('res.user')), [
+                ("(('email', '=', '?'),)", 2),
+                ("(('name', '=', '?'),)", 1),
+                ])
+
+        advice = ModelInfo.advise_indexes()['res.user']
+        self.assertIn('name', advice['indexed'])
+        self.assertNotIn('email', advice['indexed'])
+        email_search, = [x for x in advice['searches']
+            if 'email' in x['domain']]
+        self.assertTrue(email_search['plan'])
+        self.assertTrue(email_search['full_scan'])
+        self.assertEqual(advice['fields']['email']['full_scans'], 2)
+        self.assertTrue(advice['fields']['email']['suggested'])
+        self.assertFalse(advice['fields']['name']['suggested'])
+
+        Model.analyse_searches(Model.search([('name', '=', 'res.user')]))
+        email, login, name = [Field.search([
+                    ('model.name', '=', 'res.user'),
+                    ('name', '=', x),
+                    ])[0] for x in ['email', 'login', 'name']]
+        self.assertEqual(email.search_calls, 2)
+        self.assertTrue(email.suggested_index)
+        self.assertFalse(email.indexed)
+        self.assertEqual(name.search_calls, 1)
+        self.assertTrue(name.indexed)
+        self.assertFalse(name.suggested_index)
+        self.assertEqual(login.search_calls, 0)
+
+    def test_search_stats_full_scan(self):
+        'Test the detection of the full table scans in query plans'
+        query = 'SELECT "a"."id" FROM "party_party" AS "a"'
+        self.assertTrue(SearchStats.full_scan(['SCAN a'], query,
+                'party_party'))
+        self.assertTrue(SearchStats.full_scan(
+                ['SCAN a USING INDEX party_party_name_index'], query,
+                'party_party'))
+        self.assertFalse(SearchStats.full_scan(
+                ['SEARCH a USING INDEX party_party_name_index (name=?)'],
+                query, 'party_party'))
+        self.assertTrue(SearchStats.full_scan(
+                ['Seq Scan on party_party a  (cost=0.00..1.01 rows=1)'],
+                query, 'party_party'))
+        self.assertFalse(SearchStats.full_scan(['SCAN b'], query,
+                'party_party'))
+
+    def test_tracer(self):
+        'Test the span tree of the traces'
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ['directory', 'threshold', 'sql', 'max_events']:
+            self.addCleanup(setattr, Tracer, name, getattr(Tracer, name))
+        Tracer.directory, Tracer.threshold, Tracer.sql = directory, 0, False
+        Tracer.max_events = 3
+
+        with Tracer.span('rpc', 'rpc'):
+            with Tracer.span('method', 'method'):
+                for i in range(5):
+                    Tracer.wrap(_inner, 'field:get', 'field')()
+        filename, = os.listdir(directory)
+        with open(os.path.join(directory, filename)) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual([x['name'] for x in events],
+            ['rpc', 'field:get', 'field:get', 'field:get'])
+        self.assertEqual(events[0]['args'], {'dropped_events': 3})
+        self.assertTrue(all(x['ts'] >= events[0]['ts'] for x in events))
+
+        Tracer.threshold = 10
+        with Tracer.span('fast', 'rpc'):
+            pass
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+    @with_transaction()
+    def test_activate_tracing(self):
+        'Test the traces of the methods traced by the hook'
+        from trytond.protocols import dispatcher
+
+        pool = Pool()
+        User = pool.get('res.user')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ['directory', 'threshold', 'sql', 'max_events',
+                '_patched']:
+            self.addCleanup(setattr, Tracer, name, getattr(Tracer, name))
+        self.addCleanup(setattr, dispatcher, '_dispatch',
+            dispatcher._dispatch)
+        for _, Model in pool.iterobject():
+            if hasattr(Model, 'read'):
+                self.restore_method(Model, 'read')
+            for field in Model._fields.values():
+                if not hasattr(field, 'get'):
+                    continue
+                if 'get' in field.__dict__:
+                    self.addCleanup(object.__setattr__, field, 'get',
+                        field.__dict__['get'])
+                else:
+                    self.addCleanup(field.__dict__.pop, 'get', None)
+        self.set_config('debug', 'tracing_directory', directory)
+        self.set_config('debug', 'tracing_threshold', '0')
+        self.set_config('debug', 'tracing_methods', 'read')
+        self.set_config('debug', 'tracing_fields_methods', 'get')
+        self.set_config('debug', 'tracing_sql', 'True')
+        Tracer._patched = False
+        activate_tracing(pool, False)
+
+        # The dispatcher is only patched once
+        dispatch = dispatcher._dispatch
+        self.assertEqual(dispatch.__name__, 'traced_dispatch')
+        Tracer.patch_dispatch()
+        self.assertIs(dispatcher._dispatch, dispatch)
+
+        admin, = User.search([('login', '=', 'admin')])
+        User.read([admin.id], ['login', 'groups', 'rec_name'])
+        filename, = os.listdir(directory)
+        self.assertIn('res_user_read', filename)
+        with open(os.path.join(directory, filename)) as f:
+            root, *events = json.load(f)['traceEvents']
+        self.assertEqual((root['name'], root['cat']),
+            ('res.user.read', 'method'))
+        names = {x['name'] for x in events if x['cat'] == 'field'}
+        self.assertIn('res.user.groups:get', names)
+        self.assertIn('res.user.rec_name:get', names)
+        self.assertTrue(any(x['cat'] == 'sql' and 'SELECT' in x['name']
+                for x in events))
+        for event in events:
+            self.assertGreaterEqual(event['ts'], root['ts'])
+            self.assertLessEqual(event['ts'] + event['dur'],
+                root['ts'] + root['dur'])
+
+    def test_profile_to_folded(self):
+        'Test the conversion of profiles to folded stacks'
+        profiler = cProfile.Profile()
+        profiler.runcall(_outer)
+        folded = profile_to_folded(pstats.Stats(profiler))
+        stacks = [x.split(';') for x in folded]
+        inner = [x for x in stacks if x[-1].endswith('(_inner)')]
+        self.assertEqual(len(inner), 1)
+        self.assertTrue(inner[0][-2].endswith('(_outer)'))
+        busy = [x for x in stacks if x[-1].endswith('(_busy)')]
+        self.assertEqual(len(busy), 2)
+        self.assertTrue(all(x > 0 for x in folded.values()))
+        # The time of _busy is split between its two callers
+        durations = {';'.join(x): folded[';'.join(x)] for x in busy}
+        from_inner = next(v for k, v in durations.items()
+            if '(_inner)' in k)
+        from_outer = next(v for k, v in durations.items()
+            if '(_inner)' not in k)
+        self.assertGreater(from_inner, from_outer)
+
+    def test_flame_graph_svg(self):
+        'Test the rendering of folded stacks as a flame graph'
+        svg = flame_graph_svg({'a;b': 3.0, 'a;c<d>': 1.0, 'e': 0.00001},
+            'a & b')
+        self.assertTrue(svg.startswith('<?xml'))
+        self.assertTrue(svg.endswith('</svg>'))
+        self.assertIn('a &amp; b', svg)
+        self.assertIn('<title>a (4.000s, 100.0%)</title>', svg)
+        self.assertIn('<title>b (3.000s, 75.0%)</title>', svg)
+        self.assertIn('c&lt;d&gt;', svg)
+        # Frames narrower than a tenth of pixel are not drawn
+        self.assertNotIn('<title>e ', svg)
+
+    def test_line_profiler(self):
+        'Test the line by line profiler'
+        key = _code_key(_three_lines)
+        profiler = LineProfiler({key})
+        self.assertEqual(profiler.runcall(_three_lines, 1), 4)
+        profiler.runcall(_three_lines, 2)
+        lines = profiler.stats[key]
+        first_line = key[1]
+        self.assertEqual(sorted(lines),
+            [first_line + 1, first_line + 2, first_line + 3])
+        self.assertTrue(all(x[0] == 2 for x in lines.values()))
+        report = LineProfiler.format_code(key, lines)
+        self.assertIn('value *= 2', report[-2])
+
+        # Only the calls made for the model class are timed
+        key = _code_key(_Base.method)
+        profiler = LineProfiler({key}, _Sub)
+        profiler.runcall(_Base().method, 1)
+        self.assertEqual(dict(profiler.stats), {})
+        profiler.runcall(_Sub().method, 1)
+        self.assertEqual(profiler.stats[key][key[1] + 2][0], 1)
+
+    def test_override_profiler(self):
+        'Test the profiling of the overrides of a model class'
+        key = _code_key(_Base.method)
+        profiler = OverrideProfiler(_Sub, {key})
+        profiler.runcall(_Sub().method, 2)
+        profiler.runcall(_Base().method, 2)
+        calls, cumulative = profiler.stats[key]
+        self.assertEqual(calls, 3)
+        self.assertGreater(cumulative, 0)
+        other = OverrideProfiler(_Sub, {key})
+        other.runcall(_Sub().method, 0)
+        profiler.add(other)
+        self.assertEqual(profiler.stats[key][0], 4)
+
+    def test_nested_profilers(self):
+        'Test the line and override profilers of the same calls'
+        key = _code_key(_Base.method)
+        trace = sys.gettrace()
+        for outer_class, inner_class in [(LineProfiler, OverrideProfiler),
+                (OverrideProfiler, LineProfiler)]:
+            profilers = {
+                LineProfiler: LineProfiler({key}, _Sub),
+                OverrideProfiler: OverrideProfiler(_Sub, {key}),
+                }
+            outer, inner = profilers[outer_class], profilers[inner_class]
+            self.assertEqual(outer.runcall(inner.runcall, _Sub().method, 2),
+                0)
+            self.assertEqual(profilers[OverrideProfiler].stats[key][0], 3)
+            lines = profilers[LineProfiler].stats[key]
+            self.assertEqual(lines[key[1] + 1][0], 3)
+            self.assertEqual(lines[key[1] + 2][0], 2)
+            self.assertIs(sys.gettrace(), trace)
+
+    @with_transaction()
+    def test_profile_overrides(self):
+        'Test the override costs of the methods profiled by the hook'
+        pool = Pool()
+        User = pool.get('res.user')
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        self.restore_method(User, 'read')
+        self.addCleanup(ModelInfo._override_stats.pop, ('res.user', 'read'),
+            None)
+        self.set_config('override_profile', 'user', 'res.user:read')
+        self.set_config('debug', 'override_profile_threshold', '0')
+        with self.assertLogs('trytond.autoprofile', 'INFO') as logs:
+            profile_overrides(pool, False)
+            admin, = User.search([('login', '=', 'admin')])
+            User.read([admin.id], ['login'])
+        self.assertIn('Override costs for res.user:read', '\n'.join(
+                logs.output))
+
+        costs = ModelInfo.raw_override_costs('res.user', 'read')
+        layers = costs['res.user:read']['layers']
+        self.assertEqual(costs['res.user:read']['calls'], 1)
+        res_layer, = [x for x in layers if x['module'] == 'res']
+        self.assertEqual(res_layer['path'], 'trytond.res.user')
+        self.assertEqual(res_layer['calls'], 1)
+        # The line profiler selects the same layers
+        frames = ModelInfo.extract_override_frames(User, 'read')
+        self.assertEqual(ModelInfo.get_override_codes(User, 'read', 'res'),
+            [x['code'] for x in frames if x['module'] == 'res'])
+
+    @with_transaction()
+    def test_query_counter(self):
+        'Test the count of the executed queries'
+        User = Pool().get('res.user')
+        transaction = Transaction()
+        connection = transaction.connection
+        with QueryCounter() as counter:
+            User.search([])
+            User.read([x.id for x in User.search([])], ['login'])
+        self.assertGreaterEqual(counter.queries, 2)
+        self.assertGreaterEqual(counter.rows, 1)
+        self.assertIs(transaction.connection, connection)
+
+    def set_config(self, section, option, value):
+        if not config.has_section(section):
+            config.add_section(section)
+            self.addCleanup(config.remove_section, section)
+        if config.has_option(section, option):
+            self.addCleanup(config.set, section, option,
+                config.get(section, option))
+        else:
+            self.addCleanup(config.remove_option, section, option)
+        config.set(section, option, value)
+
+    def restore_method(self, klass, name):
+        if name in klass.__dict__:
+            self.addCleanup(setattr, klass, name, klass.__dict__[name])
+        else:
+            self.addCleanup(delattr, klass, name)
+
+    def test_memory_profile(self):
+        'Test the memory profiling of the configured methods'
+        Allocator = type('Allocator', (_Allocator,), {})
+        self.set_config('memory_profile', 'test', 'test.allocator:allocate')
+        self.set_config('debug', 'memory_profile_threshold', '1')
+        self.set_config('debug', 'memory_profile_entries', '2')
+        with self.assertLogs('trytond.memoryprofile', 'WARNING'):
+            activate_memory_profile(
+                _FakePool(**{'test.allocator': Allocator}), False)
+        self.assertIsNot(Allocator.__dict__['allocate'],
+            _Allocator.__dict__['allocate'])
+
+        with self.assertLogs('trytond.memoryprofile', 'INFO') as logs:
+            self.assertEqual(len(Allocator.allocate(2048)), 2048)
+        header, *lines = logs.output
+        self.assertIn('Memory profile of Allocator:allocate', header)
+        self.assertRegex(header, r'peak [0-9.]+ MB, net [0-9.]+ MB$')
+        self.assertEqual(len(lines), 2)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        # Calls below the threshold are not logged
+        logger = logging.getLogger('trytond.memoryprofile')
+        with self.assertLogs('trytond.memoryprofile', 'INFO') as logs:
+            Allocator.allocate(1)
+            logger.info('end')
+        self.assertEqual(len(logs.output), 1)
+
+    @with_transaction()
+    def test_calculate_values(self):
+        'Test the calculation of the values of the Debug Instance fields'
+        pool = Pool()
+        User = pool.get('res.user')
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        admin, = User.search([('login', '=', 'admin')])
+        info = ModelInfo(model_name='res.user', id_to_calculate=admin.id,
+            hide_functions=False, filter_value='name')
+        info.recalculate_field_infos()
+        values = {x.name: x for x in info.field_infos}
+        self.assertEqual(values['login'].calculated_value, 'admin')
+        self.assertIsNone(values['login'].calculation_time)
+        function = next(x for x in info.field_infos if x.is_function)
+        self.assertGreaterEqual(function.calculation_time, 0)
+
+        self.set_config('debug', 'calculated_values_total_budget', '-1')
+        info.recalculate_field_infos()
+        self.assertTrue(all(x.calculated_value.startswith('SKIPPED')
+                for x in info.field_infos if x.is_function))
+        self.assertEqual({x.name: x for x in info.field_infos}[
+                'login'].calculated_value, 'admin')
+
+    def test_metrics_render(self):
+        'Test the Prometheus text format of the metrics'
+        calls, Metrics.calls = Metrics.calls, {}
+        try:
+            Metrics.observe('res.user', 'read', 0.02)
+            Metrics.observe('res.user', 'read', 3, error=True)
+            Metrics.observe('a"b', 'search', 20)
+            lines = Metrics.render().split('\n')
+        finally:
+            Metrics.calls = calls
+        labels = 'model="res.user",method="read"'
+        for line in [
+                '# TYPE trytond_method_calls_total counter',
+                '# TYPE trytond_method_duration_seconds histogram',
+                'trytond_method_calls_total{%s} 2' % labels,
+                'trytond_method_errors_total{%s} 1' % labels,
+                'trytond_method_duration_seconds_bucket{%s,le="0.01"} 0'
+                % labels,
+                'trytond_method_duration_seconds_bucket{%s,le="0.025"} 1'
+                % labels,
+                'trytond_method_duration_seconds_bucket{%s,le="5"} 2'
+                % labels,
+                'trytond_method_duration_seconds_bucket{%s,le="+Inf"} 2'
+                % labels,
+                'trytond_method_duration_seconds_sum{%s} 3.02' % labels,
+                'trytond_method_duration_seconds_count{%s} 2' % labels,
+                'trytond_method_duration_seconds_bucket{model="a\\"b",'
+                'method="search",le="10"} 0',
+                'trytond_method_duration_seconds_bucket{model="a\\"b",'
+                'method="search",le="+Inf"} 1',
+                ]:
+            self.assertIn(line, lines)
+
+    @with_transaction()
+    def test_collect_metrics(self):
+        'Test the metrics of the methods measured by the hook'
+        pool = Pool()
+        User = pool.get('res.user')
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        for name in ['calls', 'buckets']:
+            self.addCleanup(setattr, Metrics, name, getattr(Metrics, name))
+        Metrics.calls = {}
+        for _, Model in pool.iterobject():
+            for method in ['search', 'read']:
+                if hasattr(Model, method):
+                    self.restore_method(Model, method)
+        self.set_config('debug', 'metrics', 'True')
+        self.set_config('debug', 'metrics_methods', 'search,read')
+        self.set_config('debug', 'metrics_buckets', '10,0.000001')
+        collect_metrics(pool, False)
+        self.assertEqual(Metrics.buckets, (0.000001, 10))
+
+        admin, = User.search([('login', '=', 'admin')])
+        User.read([admin.id], ['login'])
+        with self.assertRaises(Exception):
+            User.read([admin.id], ['login'], 'not a context')
+        lines = ModelInfo.raw_metrics().split('\n')
+        search = 'model="res.user",method="search"'
+        read = 'model="res.user",method="read"'
+        for line in [
+                'trytond_method_calls_total{%s} 1' % search,
+                'trytond_method_errors_total{%s} 0' % search,
+                'trytond_method_calls_total{%s} 2' % read,
+                'trytond_method_errors_total{%s} 1' % read,
+                'trytond_method_duration_seconds_bucket{%s,le="1e-06"} 0'
+                % read,
+                'trytond_method_duration_seconds_bucket{%s,le="10"} 2'
+                % read,
+                'trytond_method_duration_seconds_bucket{%s,le="+Inf"} 2'
+                % read,
+                'trytond_method_duration_seconds_count{%s} 2' % read,
+                ]:
+            self.assertIn(line, lines)
+
+    def test_strongly_connected(self):
+        'Test the detection of the on_change depends cycles'
+        graph = {1: [2], 2: [3], 3: [1, 4], 4: [], 5: [5], 6: [1]}
+        cycles = DebugModelInstance._strongly_connected(graph)
+        self.assertEqual(sorted(sorted(x) for x in cycles), [[1, 2, 3], [5]])
+        self.assertEqual(DebugModelInstance._strongly_connected(
+                {1: [2], 2: [3]}), [])
+        # Longer chains than the recursion limit
+        size = sys.getrecursionlimit() * 2
+        graph = {x: [x + 1] for x in range(size)}
+        self.assertEqual(DebugModelInstance._strongly_connected(graph), [])
+        graph[size] = [0]
+        cycle, = DebugModelInstance._strongly_connected(graph)
+        self.assertEqual(sorted(cycle), list(range(size + 1)))
+
+    @with_transaction()
+    def test_raw_pyson_infos(self):
+        'Test the encoding and validation of PYSON'
+        ModelInfo = Pool().get('ir.model.debug.model_info')
+        infos = ModelInfo.raw_pyson_infos(expressions=[
+                "Eval('active')",
+                "If(Bool(Eval('active')), ['x' * 100], [])",
+                "Eval(",
+                ])
+        self.assertEqual([x['name'] for x in infos], [
+                "If(Bool(Eval('active')), ['x' * 100], [])",
+                "Eval('active')",
+                "Eval(",
+                ])
+        self.assertGreater(infos[0]['size'], 100)
+        self.assertEqual(infos[1]['error'], '')
+        self.assertTrue(infos[2]['error'])
+        self.assertEqual(infos[2]['size'], 0)
+
+        infos = ModelInfo.raw_pyson_infos(models=['res.user'], min_size=1)
+        self.assertTrue(infos)
+        self.assertEqual({x['model'] for x in infos}, {'res.user'})
+        self.assertTrue({'field', 'view', 'button'} >= {x['kind']
+                for x in infos})
+        self.assertEqual([x for x in infos if x['error']], [])
+        self.assertEqual(infos, sorted(infos, key=lambda x: x['size'],
+                reverse=True))
+
+    @with_transaction()
+    def test_check_all_pyson(self):
+        'Test the report of the PYSON check of the Debug wizard'
+        Debug = Pool().get('debug', type='wizard')
+        session_id, _, _ = Debug.create()
+        lines = Debug(session_id).check_all_pyson(nb_largest=3).split('\n')
+        self.assertEqual(lines[0], '0 errors')
+        self.assertEqual(lines[1:3], ['', 'Largest PYSON:'])
+        self.assertEqual(len(lines), 6)
+
+    @with_transaction()
+    def test_synch_model_data(self):
+        'Test the synchronisation of the model data by chunks'
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        Menu = pool.get('ir.ui.menu')
+        Debug = pool.get('debug', type='wizard')
+        self.set_config('debug', 'synch_model_data_batch_size', '1')
+        data = ModelData.search([('model', '=', 'ir.ui.menu')],
+            order=[('id', 'ASC')], limit=3)
+        self.assertEqual(len(data), 3)
+        for idx, record in enumerate(data):
+            values = ModelData.load_values(record.fs_values)
+            if idx == 1:
+                # The name is required
+                values['name'] = None
+            else:
+                values['name'] = 'Synchronised %s' % idx
+            record.fs_values = ModelData.dump_values(values)
+        ModelData.save(data)
+
+        session_id, _, _ = Debug.create()
+        result = Debug(session_id).synch_model_data().split('\n')
+        self.assertEqual(result[0], 'Synchronised 2/3 model data')
+        self.assertEqual(len(result), 2)
+        self.assertIn('Could not synchronise model data %s to %s' % (
+                data[1].id, data[1].id), result[1])
+        self.assertEqual(Menu(data[0].db_id).name, 'Synchronised 0')
+        self.assertEqual(Menu(data[2].db_id).name, 'Synchronised 2')
+
+    @with_transaction()
+    def test_analyse_on_change(self):
+        'Test the analysis of the on_change depends of the debug data'
+        pool = Pool()
+        Model = pool.get('debug.model')
+        Field = pool.get('debug.model.field')
+        Model.refresh()
+        analysis = Model.analyse_on_change(['ir.note'])
+        self.assertEqual(list(analysis), ['ir.note'])
+        self.assertEqual(analysis['ir.note']['fields']['message'], {
+                'recomputed_fields': ['message_wrapped'],
+                'methods': ['on_change_with_message_wrapped'],
+                })
+        self.assertEqual(analysis['ir.note']['cycles'], [])
+        message, = Field.search([
+                ('model.name', '=', 'ir.note'),
+                ('name', '=', 'message'),
+                ])
+        self.assertEqual(message.on_change_fan_out, 1)
+        self.assertFalse(message.on_change_cycle)
+
+    @with_transaction()
+    def test_index_lookup(self):
+        'Test the lookup of the indexes of the debug data'
+        pool = Pool()
+        Model = pool.get('debug.model')
+        Index = pool.get('debug.model.index')
+        Model.refresh()
+        overrides = Index.lookup('method', key='get_login', module='debug',
+            override=True)
+        self.assertEqual([x['model'] for x in overrides], ['res.user'])
+        self.assertEqual([x['name'] for x in Index.lookup('target',
+                        key='res.group', model='res.user')], ['groups'])
+        self.assertIn('to_evaluate', [x['name'] for x in Index.lookup(
+                    'field', key='debug',
+                    model='ir.model.debug.model_info')])
+
+        Model.refresh()
+        self.assertEqual(len(Index.lookup('target', key='res.group',
+                    model='res.user')), 1)
+
+    def test_truncate_result(self):
+        'Test the truncation of the evaluation results'
+        self.assertEqual(repr(ModelInfo.truncate_result(list(range(5)), 2,
+                    6, 100)), '[0, 1, ... (3 more items)]')
+        self.assertEqual(repr(ModelInfo.truncate_result([[[1, 2]]], 10, 2,
+                    100)), '[[... (list of 2 items)]]')
+        self.assertEqual(ModelInfo.truncate_result('abcdef', 10, 6, 3),
+            'abc')
+        self.assertEqual(repr(ModelInfo.truncate_result(
+                    {'a': [1, 2, 3]}, 2, 6, 100)),
+            "{'a': [1, 2, ... (1 more items)]}")
+        self.assertEqual(repr(ModelInfo.truncate_result(
+                    {'a': 1, 'b': 2, 'c': 3}, 2, 6, 100)),
+            "{'a': 1, 'b': 2, ... (1 more items): ...}")
+
+    def test_format_result(self):
+        'Test the formatting of large evaluation results'
+        output = ModelInfo.format_result(list(range(150)))
+        self.assertTrue(output.startswith(
+                '# 150 items, showing the first 100\n'))
+        self.assertIn('... (50 more items)', output)
+        output = ModelInfo.format_result(iter(range(1000)))
+        self.assertTrue(output.startswith(
+                '# More than 100 items, showing the first 100\n'))
+        output = ModelInfo.format_result(['x' * 2000] * 10)
+        self.assertIn('characters truncated', output)
+
+    @with_transaction()
+    def test_evaluate_search_limit(self):
+        'Test the default limit of the searches of the evaluated instance'
+        pool = Pool()
+        User = pool.get('res.user')
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        User.create([{'login': 'user%s' % i, 'name': 'User %s' % i}
+                for i in range(3)])
+        admin, = User.search([('login', '=', 'admin')])
+        self.set_config('debug', 'evaluation_search_limit', '2')
+        info = ModelInfo(model_name='res.user', id_to_calculate=admin.id)
+
+        for expression, result in [
+                ('len(instance.search([]))', 2),
+                ('len(instance.search([], limit=3))', 3),
+                ('instance.search([], count=True)', User.search([],
+                        count=True)),
+                ('instance.search([], 0, None, None, True)', User.search([],
+                        count=True)),
+                ('instance.login', 'admin'),
+                ('isinstance(instance, instance.__class__)', True),
+                ('instance == instance.search([("login", "=", "admin")])[0]',
+                    True),
+                ('instance.__class__.read([instance], ["login"])[0]["login"]',
+                    'admin'),
+                ]:
+            info.to_evaluate = expression
+            self.assertEqual(info.evaluate(), result, expression)
+        info.to_evaluate = 'instance'
+        self.assertIs(type(info.evaluate()), User)
+
+    @with_transaction()
+    def test_autocomplete_to_evaluate(self):
+        'Test the completion of the evaluated expressions'
+        pool = Pool()
+        User = pool.get('res.user')
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        index = ModelInfo.get_attribute_index('res.user')
+        self.assertEqual(index['names'], sorted(index['names']))
+        self.assertIn('login', index['names'])
+        self.assertIn('search', index['names'])
+        self.assertEqual(index['targets']['groups'], 'res.group')
+
+        info = ModelInfo(model_name='res.user', id_to_calculate=1)
+        for expression, completions in [
+                ('instance.logi', ['instance.login']),
+                ('instance.groups.nam', ['instance.groups.name']),
+                ('instance.unknown.', []),
+                ('len(instance.logi', []),
+                ]:
+            info.to_evaluate = expression
+            self.assertEqual(
+                [x for x in info.autocomplete_to_evaluate()
+                    if x != expression],
+                completions, expression)
+
+        # The classes of the activated modules change the key
+        Overridden = type(User)('res.user', (User,),
+            {'__module__': 'trytond.modules.debug_override'})
+        self.assertNotEqual(ModelInfo.get_attribute_index_key(Overridden),
+            ModelInfo.get_attribute_index_key(User))
+
+    @with_transaction()
+    def test_evaluation_stats(self):
+        'Test the statistics of the Debug Instance evaluations'
+        pool = Pool()
+        User = pool.get('res.user')
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        admin, = User.search([('login', '=', 'admin')])
+        info = ModelInfo(model_name='res.user', id_to_calculate=admin.id,
+            to_evaluate='instance.login', must_raise_exception=False,
+            profile_evaluation=True, benchmark_runs=None, previous_runs='')
+        info.refresh()
+        self.assertEqual(info.evaluation_result, "'admin'")
+        lines = info.previous_runs.split('\n')
+        self.assertEqual(lines[:2], ['# res.user (%s)' % admin.id,
+                'instance.login'])
+        self.assertRegex(lines[2],
+            r'^# [0-9.]+ms wall, [0-9.]+ms cpu, \d+ queries, \d+ rows$')
+        self.assertTrue(any('cumulative' in x or 'function calls' in x
+                for x in lines[3:]))
+
+        # The last run of an expression replaces its previous ones
+        self.set_config('debug', 'evaluation_history_size', '2')
+        info.profile_evaluation = False
+        for expression in ['instance.name', 'instance.login', '1 / 0',
+                'instance.login']:
+            info.to_evaluate = expression
+            info.refresh()
+        runs = info.previous_runs.split('\n\n')
+        self.assertEqual([x.split('\n')[1] for x in runs],
+            ['instance.login', '1 / 0'])
+        self.assertEqual(len(runs[0].split('\n')), 3)
+
+        info.to_evaluate = '1 / 0'
+        info.refresh()
+        self.assertTrue(info.evaluation_result.startswith('ERROR: '))
+
+    @with_transaction()
+    def test_run_benchmark(self):
+        'Test the benchmark mode of the Debug Instance evaluations'
+        pool = Pool()
+        User = pool.get('res.user')
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        admin, = User.search([('login', '=', 'admin')])
+        info = ModelInfo(model_name='res.user', id_to_calculate=admin.id,
+            to_evaluate='instance.search([])', must_raise_exception=True,
+            profile_evaluation=False, benchmark_runs=3, benchmark_warmup=1,
+            benchmark_clear_cache=True, previous_runs='')
+        info.run_benchmark()
+        lines = info.previous_runs.split('\n')
+        self.assertEqual(lines[:3], ['# res.user (%s)' % admin.id,
+                'instance.search([])', '# 3 runs (1 warm-up, cache cleared)'])
+        for line, key in zip(lines[3:7], ['wall', 'cpu', 'queries', 'rows']):
+            self.assertTrue(line.startswith('# %s: min ' % key), line)
+        self.assertEqual(len(lines[7].split(',')), 3)
+        self.assertIn('res.user', info.evaluation_result)
+
+        stats = {'runs': []}
+        self.assertEqual(ModelInfo.format_stats(stats),
+            '# No benchmark run completed')
+
+        # Invalid numbers of runs do not break the evaluation
+        for runs, warmup in [(0, 0), (-1, 0), (2, -1)]:
+            info.benchmark_runs, info.benchmark_warmup = runs, warmup
+            info.previous_runs = ''
+            info.run_benchmark()
+            self.assertIn('res.user', info.evaluation_result)
+            self.assertEqual('# 2 runs' in info.previous_runs, runs == 2)
+
+    def enable_debug_views(self, **options):
+        self.addCleanup(setattr, ModelView, 'fields_view_get',
+            ModelView.__dict__['fields_view_get'])
+        if options.get('debug_views_costs'):
+            for _, Model in Pool().iterobject():
+                if not issubclass(Model, ModelSQL):
+                    continue
+                if 'read' in Model.__dict__:
+                    self.addCleanup(setattr, Model, 'read',
+                        Model.__dict__['read'])
+                else:
+                    self.addCleanup(delattr, Model, 'read')
+        self.set_config('debug', 'debug_views', 'True')
+        for option, value in options.items():
+            self.set_config('debug', option, value)
+        enable_debug_views(Pool(), False)
+
+    @with_transaction()
+    def test_debug_views(self):
+        'Test the developer views split in lazy loaded pages'
+        User = Pool().get('res.user')
+        self.enable_debug_views(debug_views_page_size='5')
+        standard = User.fields_view_get(view_type='form')
+        with Transaction().set_context(developper_view=True):
+            form = User.fields_view_get(view_type='form')
+            tree = User.fields_view_get(view_type='tree')
+        self.assertEqual(standard['fields']['login']['string'], 'Login')
+        self.assertEqual(set(tree['fields']), {'id', 'rec_name'})
+
+        arch = form['arch']
+        self.assertIn('<notebook colspan="2">', arch)
+        pages = [arch.index('<page string="%s' % x) for x in
+            ['Fields (1/', 'Function Fields', 'Relations']]
+        self.assertEqual(pages, sorted(pages))
+        first_page = arch[arch.index('<page'):arch.index('</page>')]
+        self.assertEqual(first_page.count('<field '), 5)
+
+        fields = form['fields']
+        self.assertEqual(fields['login']['string'], 'Login (login)')
+        self.assertNotEqual(fields['login'].get('loading'), 'lazy')
+        self.assertIn('[Function]', fields['password']['string'])
+        self.assertEqual(fields['password']['loading'], 'lazy')
+        self.assertEqual(fields['groups']['loading'], 'lazy')
+        self.assertEqual(fields['login']['states'], {'readonly': True})
+
+    @with_transaction()
+    def test_debug_views_by_module(self):
+        'Test the developer views grouped by module'
+        User = Pool().get('res.user')
+        self.enable_debug_views(debug_views_group_by='module')
+        with Transaction().set_context(developper_view=True):
+            arch = User.fields_view_get(view_type='form')['arch']
+        # The fields of the core modules are not declared in a module
+        self.assertEqual(arch.count('<page '), 1)
+        self.assertIn('<page string="trytond" id="trytond_0"', arch)
+        self.assertIn('<field name="login"/>', arch)
+
+    @with_transaction()
+    def test_read_costs(self):
+        'Test the storage of the last read costs per field'
+        ModelInfo = Pool().get('ir.model.debug.model_info')
+        ModelInfo.add_read_cost('res.user', 'login', 0.5, 3)
+        ModelInfo.add_read_cost('res.user', 'login', 0.042, 2)
+        ModelInfo.add_read_cost('res.group', 'name', 0.1, 1)
+        self.assertEqual(ModelInfo.get_read_costs('res.user'),
+            {'res.user': {'login': (0.042, 2)}})
+        self.assertEqual(ModelInfo.raw_read_costs()['res.group'],
+            {'name': {'duration': 0.1, 'queries': 1}})
+
+    @with_transaction()
+    def test_read_costs_labels(self):
+        'Test the annotation of the fields labels with their read costs'
+        pool = Pool()
+        User = pool.get('res.user')
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        self.enable_debug_views(debug_views_costs='True')
+        admin, = User.search([('login', '=', 'admin')])
+        without_fields = User.read([admin.id], [])
+        with Transaction().set_context(developper_view=True):
+            rows = User.read([admin.id], ['login', 'groups', 'rec_name'])
+            self.assertEqual(set(rows[0]), {'id', 'login', 'groups',
+                    'rec_name'})
+            self.assertEqual(rows[0]['login'], 'admin')
+            # Reading no field falls back to the standard read
+            self.assertEqual(User.read([admin.id], []), without_fields)
+            ModelInfo.add_read_cost('res.user', 'login', 0.042, 12)
+            fields = User.fields_view_get(view_type='form')['fields']
+        costs = ModelInfo.get_read_costs('res.user')['res.user']
+        self.assertEqual(set(costs), {'login', 'groups', 'rec_name'})
+        self.assertEqual(fields['login']['string'],
+            'Login (login) [42ms, 12 queries]')
+        self.assertIn('last read before this view was loaded',
+            fields['login']['help'])
+        self.assertFalse(fields['password']['help'])
+        self.assertRegex(fields['rec_name']['string'],
+            r'^.* \(rec_name\) \[Function, \d+ms, \d+ queries\]$')
+
+    @with_transaction()
+    def test_cache_stats(self):
+        'Test the counters of the caches'
+        cache = _CountedCache('debug.test_cache_stats', size_limit=2)
+        CacheStats._patch_class(_CountedCache)
+        self.addCleanup(CacheStats.counters.pop, 'debug.test_cache_stats',
+            None)
+        cache.set(1, 'a')
+        self.assertEqual(cache.get(1), 'a')
+        self.assertIsNone(cache.get(2))
+        cache.set(2, 'b')
+        cache.set(3, 'c')
+        # Only the flush at the commit is an invalidation
+        cache.clear()
+        self.assertEqual(CacheStats.report()['debug.test_cache_stats'][
+                'invalidations'], 0)
+        MemoryCache.commit(Transaction())
+        data = CacheStats.report()['debug.test_cache_stats']
+        self.assertEqual(data['hits'], 1)
+        self.assertEqual(data['misses'], 1)
+        self.assertEqual(data['sets'], 3)
+        self.assertEqual(data['evictions'], 1)
+        self.assertEqual(data['invalidations'], 1)
+        self.assertEqual(data['hit_ratio'], 0.5)
+        self.assertEqual(data['size_limit'], 2)
+
+    @with_transaction()
+    def test_instrument_caches(self):
+        'Test the counters of the caches instrumented by the hook'
+        pool = Pool()
+        ModelInfo = pool.get('ir.model.debug.model_info')
+        name = 'ir.model.debug.model_info.attributes'
+        for method in ['get', 'set', '_clear']:
+            self.restore_method(MemoryCache, method)
+        for attr in ['_patched', 'log_interval']:
+            self.addCleanup(setattr, CacheStats, attr,
+                getattr(CacheStats, attr))
+        CacheStats._patched = set()
+        self.addCleanup(CacheStats.counters.pop, name, None)
+        CacheStats.counters.pop(name, None)
+        self.set_config('debug', 'cache_stats', 'True')
+        instrument_caches(pool, False)
+        self.assertIn(MemoryCache, CacheStats._patched)
+
+        ModelInfo._attribute_index_cache.clear()
+        MemoryCache.commit(Transaction())
+        ModelInfo.get_attribute_index('res.user')
+        ModelInfo.get_attribute_index('res.user')
+        data = ModelInfo.raw_cache_stats()[name]
+        self.assertEqual((data['hits'], data['misses'], data['sets'],
+                data['invalidations']), (1, 1, 1, 1))
+
+    @with_transaction()
+    def test_survey(self):
+        'Test the survey of the ORM workloads of the models'
+        results = survey(['res.user', 'res.group', 'debug.unknown'], 10)
+        self.assertEqual(sorted(x['model'] for x in results),
+            ['debug.unknown', 'res.group', 'res.user'])
+        self.assertEqual(results[-1]['model'], 'debug.unknown')
+        self.assertIn('error', results[-1])
+        user = next(x for x in results if x['model'] == 'res.user')
+        self.assertEqual(user['records'], 1)
+        self.assertGreaterEqual(user['read_queries'], 1)
+        self.assertIn('rec_name', user['fields'])
+        self.assertIn('name', user['searches'])
+        lines = format_survey(results, 2)
+        self.assertTrue(lines[1].startswith('res.'))
+        self.assertIn('ERROR', lines[3])
+        self.assertEqual(len(lines), 8)
+
+    @with_transaction()
+    def test_capture(self):
+        'Test the capture of calls'
+        User = Pool().get('res.user')
+        admin, = User.search([('login', '=', 'admin')])
+        self.assertEqual(_compact([admin, admin]), {
+                '__class__': 'debug.records',
+                'model': 'res.user',
+                'ids': [admin.id, admin.id],
+                })
+        self.assertEqual(_compact({'a': admin, 'b': (1, {2})}), {
+                'a': {'__class__': 'debug.record', 'model': 'res.user',
+                    'id': admin.id},
+                'b': [1, [2]],
+                })
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = capture_call(directory, 'res.user', 'read',
+                ([admin.id], ['login']), {}, 1.5)
+            self.assertEqual(os.listdir(directory), [os.path.basename(path)])
+            with Transaction().set_context(invalid={(1, 2): 3}):
+                with self.assertRaises(TypeError):
+                    capture_call(directory, 'res.user', 'read', (), {}, 1)
+            # No partial capture is left
+            self.assertEqual(os.listdir(directory), [os.path.basename(path)])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_replay_capture(self):
+        'Test the replay of a captured call'
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with Transaction().start(DB_NAME, USER) as transaction:
+            User = Pool().get('res.user')
+            admin, = User.search([('login', '=', 'admin')])
+            with transaction.set_context(language='en'):
+                path = capture_call(directory, 'res.group', 'create',
+                    ([{'name': 'Replayed', 'users': [('add', [admin])]}],),
+                    {}, 1.5)
+            data = load_capture(path)
+            self.assertEqual(data['model'], 'res.group')
+            self.assertEqual(data['args'],
+                [[{'name': 'Replayed', 'users': [['add', [admin]]]}]])
+            self.assertIsInstance(data['args'][0][0]['users'][0][1][0], User)
+            self.assertEqual(data['context']['language'], 'en')
+            self.assertEqual(data['summary'], ['res.user x 1'])
+
+        duration, report = replay_capture(path, profile=False)
+        self.assertGreater(duration, 0)
+        self.assertEqual(report, '')
+        duration, report = replay_capture(path, sort='tottime', entries=5)
+        self.assertIn('function calls', report)
+        self.assertIn('Ordered by: internal time', report)
+
+        # The replayed calls are rolled back
+        with Transaction().start(DB_NAME, USER):
+            Group = Pool().get('res.group')
+            self.assertEqual(Group.search([('name', '=', 'Replayed')]), [])
+
 
 del ModuleTestCase
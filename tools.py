@@ -0,0 +1,1215 @@
+# This file is part of Coog. The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+import os
+import re
+import copy
+import sys
+import json
+import time
+import types
+import logging
+import zlib
+import linecache
+import itertools
+import threading
+from collections import defaultdict, OrderedDict
+from xml.sax.saxutils import escape
+
+from trytond.transaction import Transaction
+
+__all__ = [
+    'QueryCounter',
+    'StartupCosts',
+    'CacheStats',
+    'SearchStats',
+    'Tracer',
+    'Metrics',
+    'LineProfiler',
+    'OverrideProfiler',
+    'deep_sizeof',
+    'profile_to_folded',
+    'flame_graph_svg',
+    ]
+
+STARTUP_PHASES = ('import', 'register', 'fill', 'setup', 'post_setup',
+    'register_db')
+
+
+class _CountingCursor(object):
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter.queries += 1
+        res = self._cursor.execute(*args, **kwargs)
+        return self if res is self._cursor else res
+
+    def executemany(self, *args, **kwargs):
+        self._counter.queries += 1
+        res = self._cursor.executemany(*args, **kwargs)
+        return self if res is self._cursor else res
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._counter.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._counter.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._counter.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._counter.rows += 1
+            yield row
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._cursor.__exit__(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _CountingConnection(object):
+    def __init__(self, connection, counter):
+        self._connection = connection
+        self._counter = counter
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(
+            self._connection.cursor(*args, **kwargs), self._counter)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class QueryCounter(object):
+    '''
+        Counts the queries executed (and rows fetched) through the current
+        transaction's connection while active :
+
+            with QueryCounter() as counter:
+                Model.read(ids, ['name'])
+            counter.queries, counter.rows
+    '''
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self._transaction = None
+        self._connection = None
+
+    def __enter__(self):
+        self._transaction = Transaction()
+        self._connection = self._transaction.connection
+        self._transaction.connection = _CountingConnection(
+            self._connection, self)
+        return self
+
+    def __exit__(self, *args):
+        self._transaction.connection = self._connection
+        self._transaction = self._connection = None
+
+
+_SIZEOF_STOP = (type, types.ModuleType, types.FunctionType,
+    types.BuiltinFunctionType, types.MethodType, types.CodeType,
+    types.FrameType, threading.Thread)
+
+
+def deep_sizeof(obj, seen=None):
+    '''
+        Approximate size in bytes of obj and of the objects it holds.
+        Classes, modules and functions are not followed, and objects in seen
+        (a set of ids, updated) are not counted again
+    '''
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SIZEOF_STOP):
+            continue
+        seen.add(id(obj))
+        try:
+            size += sys.getsizeof(obj)
+        except TypeError:
+            continue
+        if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+            continue
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__') and not isinstance(obj, dict):
+            stack.append(obj.__dict__)
+        for klass in type(obj).__mro__:
+            slots = getattr(klass, '__slots__', ())
+            for slot in ((slots,) if isinstance(slots, str) else slots):
+                if slot != '__dict__' and hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+
+class StartupCosts(object):
+    '''
+        Records the time spent initializing the pool, per module and per
+        model :
+
+            - import / register : python import of the module and call of its
+              "register" function (only for modules imported after "debug")
+            - fill : creation of the pool classes
+            - setup / post_setup : "__setup__" and "__post_setup__" calls
+            - register_db : "__register__" calls (when updating the database)
+    '''
+    _lock = threading.Lock()
+    _patched = False
+    modules = defaultdict(lambda: dict.fromkeys(STARTUP_PHASES, 0.0))
+    models = defaultdict(lambda: dict.fromkeys(STARTUP_PHASES, 0.0))
+    model_modules = {}
+    _current_module = None
+    _registering = set()
+
+    @classmethod
+    def add(cls, phase, duration, module=None, model=None):
+        with cls._lock:
+            if module:
+                cls.modules[module][phase] += duration
+            if model:
+                cls.models[model][phase] += duration
+
+    @classmethod
+    def patch(cls):
+        if cls._patched:
+            return
+        cls._patched = True
+        cls._patch_import()
+        cls._patch_pool()
+
+    @classmethod
+    def _patch_import(cls):
+        import trytond.modules
+
+        import_module = trytond.modules.import_module
+
+        def timed_import_module(name, *args, **kwargs):
+            start = time.perf_counter()
+            module = import_module(name, *args, **kwargs)
+            if name not in cls.modules:
+                cls.add('import', time.perf_counter() - start, module=name)
+                register = getattr(module, 'register', None)
+                if register is not None:
+                    module.register = cls._timed_register(name, register)
+            return module
+
+        trytond.modules.import_module = timed_import_module
+
+    @classmethod
+    def _timed_register(cls, name, register):
+        def timed_register():
+            start = time.perf_counter()
+            try:
+                return register()
+            finally:
+                cls.add('register', time.perf_counter() - start, module=name)
+        return timed_register
+
+    @classmethod
+    def _patch_pool(cls):
+        from trytond.pool import Pool
+
+        fill = Pool.fill
+
+        def timed_fill(pool, module, modules):
+            cls._current_module = module
+            start = time.perf_counter()
+            classes = fill(pool, module, modules)
+            cls.add('fill', time.perf_counter() - start, module=module)
+            for type_classes in classes.values():
+                for klass in type_classes:
+                    cls.model_modules.setdefault(klass.__name__, module)
+                    cls._patch_register_db(klass)
+            return classes
+
+        setup = Pool.setup
+
+        def timed_setup(pool, classes=None):
+            # The original setup is called with the "__setup__" and
+            # "__post_setup__" of the classes temporarily timed. When all
+            # classes are set up at once, the cost is given to the module
+            # declaring the model
+            current_module = cls._current_module if classes else None
+            if classes is None:
+                to_time = [x for type_classes in
+                    pool._pool[pool.database_name].values()
+                    for x in type_classes.values()]
+            else:
+                to_time = [x for lst in classes.values() for x in lst]
+            patched = []
+            try:
+                for klass in to_time:
+                    for phase in ('setup', 'post_setup'):
+                        name = '__%s__' % phase
+                        patched.append((klass, name, klass.__dict__.get(name)))
+                        setattr(klass, name, cls._timed_setup_method(klass,
+                                name, phase, current_module))
+                return setup(pool, classes)
+            finally:
+                for klass, name, raw in reversed(patched):
+                    if raw is None:
+                        delattr(klass, name)
+                    else:
+                        setattr(klass, name, raw)
+
+        Pool.fill = timed_fill
+        Pool.setup = timed_setup
+
+    @classmethod
+    def _timed_setup_method(cls, klass, name, phase, module):
+        raw = klass.__dict__.get(name)
+
+        def timed(called_cls):
+            if raw is not None:
+                method = raw.__get__(None, called_cls)
+            else:
+                method = getattr(super(klass, called_cls), name)
+            if called_cls is not klass:
+                # Called on a subclass, which is timed on its own
+                return method()
+            start = time.perf_counter()
+            try:
+                return method()
+            finally:
+                cls.add(phase, time.perf_counter() - start,
+                    module=module or cls.model_modules.get(klass.__name__),
+                    model=klass.__name__)
+        return classmethod(timed)
+
+    @classmethod
+    def _patch_register_db(cls, klass):
+        register = klass.__register__.__func__
+
+        # Overrides registered by later modules will call this one through
+        # super, so only the outermost call is timed
+        def timed_register(model, module_name):
+            key = (model.__name__, module_name)
+            if key in cls._registering:
+                return register(model, module_name)
+            cls._registering.add(key)
+            start = time.perf_counter()
+            try:
+                return register(model, module_name)
+            finally:
+                cls._registering.discard(key)
+                cls.add('register_db', time.perf_counter() - start,
+                    module=module_name, model=model.__name__)
+
+        klass.__register__ = classmethod(timed_register)
+
+    @classmethod
+    def report(cls, entries=None):
+        '''
+            Returns the recorded costs, with the most expensive modules and
+            models first
+        '''
+        def sort(data):
+            result = [dict(name=name, total=sum(values.values()), **values)
+                for name, values in data.items()]
+            result.sort(key=lambda x: x['total'], reverse=True)
+            return result[:entries] if entries else result
+
+        with cls._lock:
+            return {
+                'modules': sort(cls.modules),
+                'models': [dict(x, module=cls.model_modules.get(x['name']))
+                    for x in sort(cls.models)],
+                }
+
+    @classmethod
+    def format_report(cls, entries=None):
+        report = cls.report(entries)
+        header = '%-40s' + ' %12s' * (len(STARTUP_PHASES) + 1)
+        line = '%-40s' + ' %10.1fms' * (len(STARTUP_PHASES) + 1)
+        lines = []
+        for kind in ('modules', 'models'):
+            lines.append(header % ((kind,) + STARTUP_PHASES + ('total',)))
+            for data in report[kind]:
+                lines.append(line % ((data['name'],) + tuple(
+                            data[x] * 1000
+                            for x in STARTUP_PHASES + ('total',))))
+        return lines
+
+
+CACHE_COUNTERS = ('hits', 'misses', 'sets', 'evictions', 'invalidations')
+
+
+class CacheStats(object):
+    '''
+        Counts the hits, misses, sets, evictions (because of the size limit)
+        and invalidations of the in-process caches, per cache name. An
+        invalidation is a flush of the process cache (its "_clear" method),
+        which happens when a transaction clearing the cache is committed or
+        when another process cleared it, so "clear" is not counted.
+    '''
+    _lock = threading.Lock()
+    _patched = set()
+    _missing = object()
+    counters = defaultdict(lambda: dict.fromkeys(CACHE_COUNTERS, 0))
+    log_interval = 0
+    _last_log = 0
+
+    @classmethod
+    def add(cls, name, counter, value=1):
+        with cls._lock:
+            cls.counters[name][counter] += value
+            if not cls.log_interval:
+                return
+            now = time.monotonic()
+            if now - cls._last_log < cls.log_interval:
+                return
+            cls._last_log = now
+        cls.log()
+
+    @classmethod
+    def patch(cls, log_interval=0):
+        from trytond.cache import BaseCache
+
+        cls.log_interval = log_interval
+        cls._last_log = time.monotonic()
+        for cache in list(BaseCache._instances.values()):
+            if not hasattr(cache, '_get_cache'):
+                continue
+            klass = next(x for x in type(cache).__mro__ if 'get' in x.__dict__)
+            if klass in cls._patched:
+                continue
+            cls._patched.add(klass)
+            cls._patch_class(klass)
+
+    @classmethod
+    def _patch_class(cls, klass):
+        get, set_, _clear = klass.get, klass.set, klass._clear
+
+        def counted_get(cache, key, default=None):
+            result = get(cache, key, cls._missing)
+            if result is cls._missing:
+                cls.add(cache._name, 'misses')
+                return default
+            cls.add(cache._name, 'hits')
+            return result
+
+        def counted_set(cache, key, value):
+            try:
+                lru = cache._get_cache()
+                before = len(lru) + (cache._key(key) not in lru)
+            except TypeError:
+                return set_(cache, key, value)
+            result = set_(cache, key, value)
+            cls.add(cache._name, 'sets')
+            if before > len(lru):
+                cls.add(cache._name, 'evictions', before - len(lru))
+            return result
+
+        def counted__clear(cache, *args, **kwargs):
+            cls.add(cache._name, 'invalidations')
+            return _clear(cache, *args, **kwargs)
+
+        klass.get = counted_get
+        klass.set = counted_set
+        klass._clear = counted__clear
+
+    @classmethod
+    def report(cls):
+        '''
+            Returns the counters and the current size of each cache
+        '''
+        from trytond.cache import BaseCache
+
+        with cls._lock:
+            counters = {k: dict(v) for k, v in cls.counters.items()}
+        result = {}
+        for name, cache in list(BaseCache._instances.items()):
+            if not hasattr(cache, '_get_cache'):
+                continue
+            data = counters.get(name, dict.fromkeys(CACHE_COUNTERS, 0))
+            lookups = data['hits'] + data['misses']
+            data['hit_ratio'] = data['hits'] / lookups if lookups else None
+            data['size_limit'] = cache.size_limit
+            data['entries'] = sum(len(x) for x in
+                list(cache._database_cache.values()))
+            result[name] = data
+        return result
+
+    @classmethod
+    def format_report(cls):
+        lines = ['%-50s %10s %10s %7s %10s %10s %10s %8s' % ('cache', 'hits',
+                'misses', 'ratio', 'evictions', 'invalid.', 'entries',
+                'limit')]
+        for name, data in sorted(cls.report().items(),
+                key=lambda x: x[1]['hits'] + x[1]['misses'], reverse=True):
+            lines.append('%-50s %10i %10i %7s %10i %10i %10i %8i' % (name,
+                    data['hits'], data['misses'],
+                    '-' if data['hit_ratio'] is None
+                    else '%.1f%%' % (data['hit_ratio'] * 100),
+                    data['evictions'], data['invalidations'], data['entries'],
+                    data['size_limit']))
+        return lines
+
+    @classmethod
+    def log(cls):
+        logger = logging.getLogger('trytond.cache_stats')
+        for line in cls.format_report():
+            logger.info(line)
+
+
+INDEXABLE_OPERATORS = {'=', 'in', '<', '<=', '>', '>=', 'like', 'child_of',
+    'parent_of'}
+
+
+class SearchStats(object):
+    '''
+        Aggregates the search calls per model, normalized domain (values
+        replaced by "?") and order, keeping the slowest domain of each group
+        to explain its query. Only the max_entries most recently used groups
+        are kept.
+    '''
+    _lock = threading.Lock()
+    stats = OrderedDict()
+    max_entries = 1000
+
+    @classmethod
+    def normalize(cls, domain):
+        if isinstance(domain, (list, tuple)):
+            if (len(domain) >= 3 and isinstance(domain[0], str)
+                    and isinstance(domain[1], str)):
+                return (domain[0], domain[1], '?') + tuple(domain[3:])
+            return tuple(cls.normalize(x) for x in domain)
+        return domain
+
+    @classmethod
+    def copy_domain(cls, domain):
+        '''
+            Returns a copy of domain where the records are replaced by their
+            ids, so that it does not keep them (and their transaction cache)
+            alive
+        '''
+        from trytond.model import Model
+
+        if isinstance(domain, Model):
+            return domain.id
+        if isinstance(domain, (list, tuple)):
+            return type(domain)(cls.copy_domain(x) for x in domain)
+        return copy.deepcopy(domain)
+
+    @classmethod
+    def filtered_fields(cls, normalized, result=None):
+        '''
+            Returns the (field name, operator) of the clauses of a normalized
+            domain, the field name being the first part of dotted names
+        '''
+        if result is None:
+            result = []
+        for clause in normalized:
+            if not isinstance(clause, tuple):
+                continue
+            if clause and isinstance(clause[0], str):
+                result.append((clause[0].split('.')[0], clause[1]))
+            else:
+                cls.filtered_fields(clause, result)
+        return result
+
+    @classmethod
+    def record(cls, model_name, domain, order, duration):
+        try:
+            normalized = cls.normalize(domain or [])
+            order = tuple(tuple(x) for x in order or [])
+            key = (model_name, repr(normalized), order)
+        except TypeError:
+            return
+        with cls._lock:
+            data = cls.stats.get(key)
+            if data is not None:
+                cls.stats.move_to_end(key)
+            else:
+                while len(cls.stats) >= cls.max_entries:
+                    cls.stats.popitem(last=False)
+                data = cls.stats[key] = {
+                    'model': model_name,
+                    'domain': repr(normalized),
+                    'order': [list(x) for x in order],
+                    'fields': cls.filtered_fields(normalized),
+                    'count': 0,
+                    'duration': 0,
+                    'max_duration': -1,
+                    }
+            data['count'] += 1
+            data['duration'] += duration
+            if duration > data['max_duration']:
+                data['max_duration'] = duration
+                try:
+                    data['sample'] = cls.copy_domain(domain or [])
+                except Exception:
+                    data['sample'] = None
+
+    @classmethod
+    def report(cls, model_name=None):
+        '''
+            Returns the aggregated searches, most time consuming first. The
+            "sample" key holds the slowest domain of each group.
+        '''
+        with cls._lock:
+            result = [dict(x, fields=list(x['fields']))
+                for x in cls.stats.values()
+                if model_name in (None, x['model'])]
+        return sorted(result, key=lambda x: x['duration'], reverse=True)
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls.stats.clear()
+
+    @classmethod
+    def explain(cls, cursor, query):
+        '''
+            Returns the lines of the query plan of query (a python-sql query)
+        '''
+        from trytond import backend
+
+        if backend.name == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + str(query), query.params)
+            return [x[-1] for x in cursor.fetchall()]
+        cursor.execute('EXPLAIN ' + str(query), query.params)
+        return [x[0] for x in cursor.fetchall()]
+
+    @classmethod
+    def full_scan(cls, plan, query, table_name):
+        '''
+            Tells whether the plan reads the whole table_name table, which is
+            identified by its name or its alias in query
+        '''
+        names = {table_name}
+        names.update(re.findall(r'"%s" AS "(\w+)"' % re.escape(table_name),
+                str(query)))
+        for line in plan:
+            # SQLite "SCAN" reads the whole table even when using an index
+            # (for the order), only "SEARCH" uses an index to filter
+            match = (re.search(r'^SCAN (?:TABLE )?(\w+)', line.strip())
+                or re.search(r'Seq Scan on "?(\w+)"?', line))
+            if match and match.group(1) in names:
+                return True
+        return False
+
+    @classmethod
+    def indexed_columns(cls, cursor, table_name):
+        '''
+            Returns the columns of table_name which are the first column of
+            an index
+        '''
+        from trytond import backend
+
+        if backend.name == 'sqlite':
+            cursor.execute('PRAGMA index_list("%s")' % table_name)
+            result = set()
+            for index in cursor.fetchall():
+                cursor.execute('PRAGMA index_info("%s")' % index[1])
+                result.update(x[2] for x in cursor.fetchall() if x[0] == 0)
+            return result
+        cursor.execute('SELECT a.attname FROM pg_index i '
+            'JOIN pg_class c ON c.oid = i.indrelid '
+            'JOIN pg_attribute a ON a.attrelid = c.oid '
+            'AND a.attnum = i.indkey[0] '
+            'WHERE c.relname = %s', (table_name,))
+        return {x[0] for x in cursor.fetchall()}
+
+
+class _TracingCursor(_CountingCursor):
+    def execute(self, query, *args, **kwargs):
+        with Tracer.span(str(query)[:60], 'sql',
+                {'query': str(query)[:1000]}):
+            res = self._cursor.execute(query, *args, **kwargs)
+        return self if res is self._cursor else res
+
+    def executemany(self, query, *args, **kwargs):
+        with Tracer.span(str(query)[:60], 'sql',
+                {'query': str(query)[:1000]}):
+            res = self._cursor.executemany(query, *args, **kwargs)
+        return self if res is self._cursor else res
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        return self._cursor.fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class _TracingConnection(_CountingConnection):
+    def cursor(self, *args, **kwargs):
+        return _TracingCursor(self._connection.cursor(*args, **kwargs), None)
+
+
+class _Span(object):
+    __slots__ = ('name', 'category', 'args', 'start', 'connection')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.connection = None
+
+    def __enter__(self):
+        local = Tracer._local
+        if getattr(local, 'events', None) is None:
+            local.events = []
+            local.depth = 0
+            local.dropped = 0
+        local.depth += 1
+        if Tracer.sql and self.category != 'sql':
+            # Only swap the connection inside the transaction, it must be
+            # restored before the transaction is stopped
+            transaction = Transaction()
+            connection = transaction.connection
+            if (connection is not None
+                    and not isinstance(connection, _TracingConnection)):
+                self.connection = connection
+                transaction.connection = _TracingConnection(connection, None)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        end = time.perf_counter()
+        if self.connection is not None:
+            Transaction().connection = self.connection
+            self.connection = None
+        local = Tracer._local
+        event = {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': self.start * 1e6,
+            'dur': (end - self.start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            }
+        if self.args:
+            event['args'] = self.args
+        local.depth -= 1
+        if not local.depth:
+            if local.dropped:
+                event['args'] = dict(event.get('args', {}),
+                    dropped_events=local.dropped)
+            local.events.append(event)
+            events, local.events = local.events, None
+            if end - self.start >= Tracer.threshold:
+                Tracer.write(self.name, events)
+        elif len(local.events) < Tracer.max_events:
+            local.events.append(event)
+        else:
+            local.dropped += 1
+
+
+class Tracer(object):
+    '''
+        Records a tree of spans (model methods, field getters and SQL
+        queries) for each traced call, and writes the traces longer than the
+        threshold as trace-event JSON files, which can be opened in a browser
+        trace viewer (chrome://tracing, Perfetto...) :
+
+            with Tracer.span('account.invoice.post', 'method'):
+                ...
+
+        At most max_events spans are kept per trace, the number of dropped
+        ones is added to the arguments of the outermost span.
+    '''
+    _local = threading.local()
+    _counter = itertools.count()
+    _patched = False
+    threshold = 0
+    directory = None
+    sql = False
+    max_events = 100000
+
+    @classmethod
+    def patch_dispatch(cls):
+        '''
+            Traces the RPC calls, the dispatcher is shared by all the pools
+            so it is only patched once
+        '''
+        from trytond.protocols import dispatcher
+
+        if cls._patched:
+            return
+        cls._patched = True
+
+        dispatch = dispatcher._dispatch
+
+        def traced_dispatch(request, pool, *args, **kwargs):
+            with cls.span(request.rpc_method, 'rpc'):
+                return dispatch(request, pool, *args, **kwargs)
+
+        dispatcher._dispatch = traced_dispatch
+
+    @classmethod
+    def span(cls, name, category, args=None):
+        return _Span(name, category, args)
+
+    @classmethod
+    def wrap(cls, function, name, category):
+        def traced(*args, **kwargs):
+            with _Span(name, category, None):
+                return function(*args, **kwargs)
+        return traced
+
+    @classmethod
+    def write(cls, name, events):
+        events.sort(key=lambda x: (x['ts'], -x['dur']))
+        filename = os.path.join(cls.directory, 'trace-%s-%s-%s-%s.json' % (
+                time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+                next(cls._counter),
+                ''.join(x if x.isalnum() else '_' for x in name)[:80]))
+        try:
+            with open(filename, 'w') as f:
+                json.dump({
+                        'traceEvents': events,
+                        'displayTimeUnit': 'ms',
+                        }, f)
+        except (OSError, TypeError, ValueError):
+            logging.getLogger('trytond.tracing').exception(
+                'Could not write trace %s' % filename)
+
+
+class Metrics(object):
+    '''
+        Call counts and latency histograms of model methods, aggregated
+        across the threads of the process, and rendered in the Prometheus
+        text exposition format
+    '''
+    _lock = threading.Lock()
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    calls = {}
+
+    @classmethod
+    def observe(cls, model, method, duration, error=False):
+        with cls._lock:
+            data = cls.calls.get((model, method))
+            if data is None:
+                data = cls.calls[model, method] = {
+                    'count': 0,
+                    'errors': 0,
+                    'sum': 0.0,
+                    'buckets': [0] * len(cls.buckets),
+                    }
+            data['count'] += 1
+            data['sum'] += duration
+            if error:
+                data['errors'] += 1
+            for i, bound in enumerate(cls.buckets):
+                if duration <= bound:
+                    data['buckets'][i] += 1
+                    break
+
+    @classmethod
+    def wrap(cls, function, model, method):
+        def measured(*args, **kwargs):
+            start = time.perf_counter()
+            error = True
+            try:
+                result = function(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                cls.observe(model, method, time.perf_counter() - start,
+                    error)
+        return measured
+
+    @classmethod
+    def render(cls):
+        '''
+            Returns the metrics in Prometheus text format
+        '''
+        with cls._lock:
+            calls = sorted((k, dict(v, buckets=list(v['buckets'])))
+                for k, v in cls.calls.items())
+        lines = [
+            '# HELP trytond_method_calls_total Number of model method calls',
+            '# TYPE trytond_method_calls_total counter',
+            ]
+        for (model, method), data in calls:
+            lines.append('trytond_method_calls_total{%s} %i' % (
+                    cls._labels(model, method), data['count']))
+        lines += [
+            '# HELP trytond_method_errors_total Number of model method calls '
+            'which raised an exception',
+            '# TYPE trytond_method_errors_total counter',
+            ]
+        for (model, method), data in calls:
+            lines.append('trytond_method_errors_total{%s} %i' % (
+                    cls._labels(model, method), data['errors']))
+        lines += [
+            '# HELP trytond_method_duration_seconds Duration of model method '
+            'calls',
+            '# TYPE trytond_method_duration_seconds histogram',
+            ]
+        for (model, method), data in calls:
+            labels = cls._labels(model, method)
+            cumulative = 0
+            for bound, count in zip(cls.buckets, data['buckets']):
+                cumulative += count
+                lines.append(
+                    'trytond_method_duration_seconds_bucket{%s,le="%g"} %i'
+                    % (labels, bound, cumulative))
+            lines.append(
+                'trytond_method_duration_seconds_bucket{%s,le="+Inf"} %i'
+                % (labels, data['count']))
+            lines.append('trytond_method_duration_seconds_sum{%s} %r' % (
+                    labels, data['sum']))
+            lines.append('trytond_method_duration_seconds_count{%s} %i' % (
+                    labels, data['count']))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def _labels(cls, model, method):
+        def escape(value):
+            return value.replace('\\', '\\\\').replace('"', '\\"')
+        return 'model="%s",method="%s"' % (escape(model), escape(method))
+
+    @classmethod
+    def serve(cls, host, port):
+        '''
+            Serves the metrics on http://host:port/metrics in a daemon thread
+        '''
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = cls.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                    'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+
+def _frame_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        # Built-in functions
+        return name
+    path = filename.replace(os.sep, '/').split('/')
+    return '%s:%s(%s)' % ('/'.join(path[-2:]), lineno, name)
+
+
+def profile_to_folded(stats, max_depth=200, min_ratio=0.001):
+    '''
+        Converts a pstats.Stats to folded stacks ({"a;b;c": seconds}).
+
+        cProfile only keeps caller / callee pairs, so the time of a function
+        is split among the stacks it appears in, proportionally to the time
+        of each caller / callee pair. Recursive calls are folded in their
+        first occurrence, and stacks under min_ratio of the total are dropped.
+    '''
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller][func] = cumulative
+    roots = [func for func, data in stats.stats.items() if not data[4]]
+    total = sum(stats.stats[x][3] for x in roots) or 1
+    folded = defaultdict(float)
+
+    stack = [(x, (_frame_label(x),), (x,), 1.0) for x in roots]
+    while stack:
+        func, labels, funcs, ratio = stack.pop()
+        _, _, own_time, cumulative, _ = stats.stats[func]
+        if own_time * ratio > 0:
+            folded[';'.join(labels)] += own_time * ratio
+        if len(funcs) >= max_depth:
+            continue
+        for callee, edge_time in callees.get(func, {}).items():
+            if callee in funcs or callee not in stats.stats:
+                continue
+            callee_time = stats.stats[callee][3]
+            if not callee_time or edge_time * ratio < total * min_ratio:
+                continue
+            stack.append((callee, labels + (_frame_label(callee),),
+                    funcs + (callee,), ratio * edge_time / callee_time))
+    return dict(folded)
+
+
+def flame_graph_svg(folded, title='', width=1200, frame_height=16):
+    '''
+        Renders folded stacks as a standalone SVG flame graph. The full name
+        and the duration of each frame are displayed when hovering it.
+    '''
+    root = {'name': 'all', 'value': 0.0, 'children': {}}
+    for stack, value in folded.items():
+        root['value'] += value
+        node = root
+        for name in stack.split(';'):
+            node = node['children'].setdefault(name,
+                {'name': name, 'value': 0.0, 'children': {}})
+            node['value'] += value
+
+    rects = []
+    total = root['value'] or 1
+    depth = 0
+    to_draw = [(root, 0.0, 0)]
+    while to_draw:
+        node, x, level = to_draw.pop()
+        node_width = node['value'] / total * width
+        if node_width < 0.1:
+            continue
+        depth = max(depth, level)
+        rects.append((node, x, level, node_width))
+        child_x = x
+        for child in sorted(node['children'].values(),
+                key=lambda c: c['name']):
+            to_draw.append((child, child_x, level + 1))
+            child_x += child['value'] / total * width
+
+    top = 3 * frame_height
+    height = top + (depth + 1) * frame_height + frame_height
+    lines = [
+        '<?xml version="1.0" standalone="no"?>',
+        '<svg version="1.1" width="%i" height="%i" '
+        'xmlns="http://www.w3.org/2000/svg" font-family="Verdana" '
+        'font-size="11">' % (width, height),
+        '<rect x="0" y="0" width="100%" height="100%" fill="#f8f8f8"/>',
+        '<text x="%i" y="%i" text-anchor="middle" font-size="16">%s</text>'
+        % (width / 2, 2 * frame_height, escape(title)),
+        ]
+    for node, x, level, node_width in rects:
+        # Flame graphs grow from the bottom
+        y = height - frame_height - (level + 1) * frame_height
+        color = zlib.crc32(node['name'].encode('utf-8'))
+        fill = 'rgb(%i,%i,%i)' % (205 + color % 50, 80 + (color >> 8) % 150,
+            (color >> 16) % 60)
+        label = '%s (%.3fs, %.1f%%)' % (node['name'], node['value'],
+            node['value'] / total * 100)
+        chars = int(node_width / 7)
+        text = node['name'] if len(node['name']) <= chars else (
+            node['name'][:chars - 2] + '..' if chars > 3 else '')
+        lines.append('<g><title>%s</title><rect x="%.1f" y="%i" '
+            'width="%.1f" height="%i" fill="%s" rx="2" ry="2"/>'
+            '<text x="%.1f" y="%i">%s</text></g>' % (escape(label), x, y,
+                node_width, frame_height - 1, fill, x + 3,
+                y + frame_height - 4, escape(text)))
+    lines.append('</svg>')
+    return '\n'.join(lines)
+
+
+def _called_for(frame, model_class):
+    '''
+        Returns whether the call of frame is made for model_class, its first
+        argument being the class or one of its records
+    '''
+    code = frame.f_code
+    if not code.co_argcount:
+        return False
+    first = frame.f_locals.get(code.co_varnames[0])
+    return first is model_class or type(first) is model_class
+
+
+def _chain_trace(previous, trace):
+    '''
+        Returns a global trace function calling previous (the one already
+        installed, if any) and trace, so that nested profilers of the same
+        calls do not hide each other. Line events are kept for a frame if one
+        of the tracers of the frame needs them.
+    '''
+    if previous is None:
+        return trace
+    traces = (previous, trace)
+
+    def chained(frame, event, arg):
+        local_traces, trace_lines = [], False
+        for global_trace in traces:
+            frame.f_trace_lines = True
+            local_trace = global_trace(frame, event, arg)
+            if local_trace is not None:
+                local_traces.append(local_trace)
+                trace_lines = trace_lines or frame.f_trace_lines
+        frame.f_trace_lines = trace_lines
+        if not local_traces:
+            return None
+        if len(local_traces) == 1:
+            return local_traces[0]
+
+        def chained_local(frame, event, arg):
+            for i, local_trace in enumerate(local_traces):
+                if local_trace is not None:
+                    local_traces[i] = local_trace(frame, event, arg)
+            return chained_local
+        return chained_local
+    return chained
+
+
+class OverrideProfiler(object):
+    '''
+        Counts the calls and measures the cumulative time of the overrides
+        of a method whose code is in codes (a set of (filename, first line,
+        name) tuples), using the python tracer. Only the calls made for
+        model_class (the first argument being the class or one of its
+        records) are measured, so the calls of the implementations shared
+        with other models (ModelSQL, ModelStorage...) are ignored :
+
+            profiler = OverrideProfiler(Model, codes)
+            profiler.runcall(Model.method, *args)
+            profiler.stats  # {code: [calls, cumulative]}
+
+        The cumulative time of recursive calls is only counted once.
+    '''
+    def __init__(self, model_class, codes):
+        self.model_class = model_class
+        self.codes = set(codes)
+        self.stats = defaultdict(lambda: [0, 0.0])
+        self._depths = defaultdict(int)
+
+    def _trace(self, frame, event, arg):
+        if event != 'call':
+            return None
+        code = frame.f_code
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        if key not in self.codes or not _called_for(frame,
+                self.model_class):
+            return None
+        frame.f_trace_lines = False
+        outermost = not self._depths[key]
+        self._depths[key] += 1
+        start = time.perf_counter()
+
+        def trace_return(frame, event, arg):
+            if event == 'return':
+                self._depths[key] -= 1
+                self.stats[key][0] += 1
+                if outermost:
+                    self.stats[key][1] += time.perf_counter() - start
+            return trace_return
+        return trace_return
+
+    def runcall(self, function, *args, **kwargs):
+        old_trace = sys.gettrace()
+        sys.settrace(_chain_trace(old_trace, self._trace))
+        try:
+            return function(*args, **kwargs)
+        finally:
+            sys.settrace(old_trace)
+
+    def add(self, other):
+        for key, (calls, cumulative) in other.stats.items():
+            self.stats[key][0] += calls
+            self.stats[key][1] += cumulative
+
+
+class LineProfiler(object):
+    '''
+        Line by line timing of the functions whose code is in codes (a set of
+        (filename, first line, name) tuples), using the python tracer. If
+        model_class is set, only the calls made for it are timed, as in
+        OverrideProfiler :
+
+            profiler = LineProfiler(codes, Model)
+            profiler.runcall(Model.method, *args)
+            profiler.stats  # {code: {line: [hits, duration]}}
+
+        The time of a line includes the calls it makes.
+    '''
+    def __init__(self, codes, model_class=None):
+        self.codes = set(codes)
+        self.model_class = model_class
+        self.stats = defaultdict(lambda: defaultdict(lambda: [0, 0.0]))
+
+    def _trace(self, frame, event, arg):
+        if event != 'call':
+            return None
+        code = frame.f_code
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        if key not in self.codes:
+            return None
+        if self.model_class is not None and not _called_for(frame,
+                self.model_class):
+            return None
+        stats = self.stats[key]
+        state = [None, 0.0]
+
+        def trace_lines(frame, event, arg):
+            now = time.perf_counter()
+            if state[0] is not None:
+                data = stats[state[0]]
+                data[1] += now - state[1]
+            if event == 'line':
+                stats[frame.f_lineno][0] += 1
+                state[0] = frame.f_lineno
+            elif event == 'return':
+                state[0] = None
+            state[1] = time.perf_counter()
+            return trace_lines
+        return trace_lines
+
+    def runcall(self, function, *args, **kwargs):
+        old_trace = sys.gettrace()
+        sys.settrace(_chain_trace(old_trace, self._trace))
+        try:
+            return function(*args, **kwargs)
+        finally:
+            sys.settrace(old_trace)
+
+    def add(self, other):
+        for key, lines in other.stats.items():
+            for lineno, (hits, duration) in lines.items():
+                self.stats[key][lineno][0] += hits
+                self.stats[key][lineno][1] += duration
+
+    @classmethod
+    def format_code(cls, key, lines):
+        '''
+            Returns the source of the function, annotated with the hits and
+            durations of each line
+        '''
+        filename, first_line, name = key
+        source = linecache.getlines(filename)
+        total = sum(x[1] for x in lines.values()) or 1
+        last_line = max(list(lines) + [first_line])
+        result = ['%s:%s(%s) %.3fs' % (filename, first_line, name,
+                sum(x[1] for x in lines.values())),
+            '%6s %8s %10s %8s %6s  %s' % ('Line', 'Hits', 'Time (ms)',
+                'Per hit', '%', 'Source')]
+        for lineno in range(first_line, last_line + 1):
+            text = source[lineno - 1].rstrip() if lineno <= len(source) else ''
+            if lineno not in lines:
+                result.append('%6i %8s %10s %8s %6s  %s' % (lineno, '', '', '',
+                        '', text))
+                continue
+            hits, duration = lines[lineno]
+            result.append('%6i %8i %10.1f %8.3f %6.1f  %s' % (lineno, hits,
+                    duration * 1000, duration * 1000 / (hits or 1),
+                    duration / total * 100, text))
+        return result
+